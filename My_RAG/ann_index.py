@@ -0,0 +1,190 @@
+"""
+IVF (inverted file) approximate nearest-neighbour index for unit vectors.
+
+Vectors are clustered with spherical k-means into nlist lists. A query is
+scored against the centroids first and only the vectors of the nprobe
+closest lists are scored exactly, so nprobe trades recall for latency
+(nprobe == nlist is exact search).
+
+On disk the vectors are stored float16 and grouped by list, so probing a
+list reads one contiguous slice of a memory-mapped file:
+    centroids.npy     float32 (nlist, dim)
+    list_offsets.npy  int64   (nlist + 1,)  list i is rows offsets[i]:offsets[i+1]
+    list_ids.npy      int64   (n,)          original row id of each stored vector
+    list_vectors.npy  float16 (n, dim)
+    ivf_meta.json
+"""
+from pathlib import Path
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+
+IVF_META_FILE = "ivf_meta.json"
+IVF_FORMAT_VERSION = 1
+DEFAULT_NPROBE = 8
+DEFAULT_KMEANS_ITERATIONS = 10
+# Vectors used to train the centroids
+DEFAULT_TRAIN_SIZE = 100_000
+# Rows upcast to float32 at a time while assigning vectors to lists
+ASSIGN_BLOCK = 65536
+
+
+def default_nlist(num_vectors):
+    """About 4 * sqrt(n) lists, at least 1."""
+    return max(1, min(num_vectors, int(4 * math.sqrt(num_vectors))))
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def train_centroids(sample, nlist, iterations=DEFAULT_KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means: centroids are re-normalized means of their members."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists with random vectors
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+
+    def __init__(self, index_dir):
+        """Opens a built index; vector data is memory-mapped, not loaded."""
+        self.index_dir = str(index_dir)
+        with open(os.path.join(self.index_dir, IVF_META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.centroids = np.load(os.path.join(self.index_dir, "centroids.npy"))
+        self.list_offsets = np.load(os.path.join(self.index_dir, "list_offsets.npy"))
+        self.list_ids = np.load(os.path.join(self.index_dir, "list_ids.npy"), mmap_mode='r')
+        self.list_vectors = np.load(os.path.join(self.index_dir, "list_vectors.npy"), mmap_mode='r')
+        self.nlist = len(self.centroids)
+
+    @classmethod
+    def exists(cls, index_dir, fingerprint=None):
+        """True if a finished index (built from fingerprint, when given) is at index_dir."""
+        meta_path = Path(index_dir) / IVF_META_FILE
+        if not meta_path.exists():
+            return False
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return fingerprint is None or meta.get('fingerprint') == fingerprint
+
+    @classmethod
+    def build(cls, vectors, index_dir, nlist=None, train_size=DEFAULT_TRAIN_SIZE,
+              iterations=DEFAULT_KMEANS_ITERATIONS, seed=0, fingerprint=None):
+        """
+        Builds an index from unit vectors (e.g. the float16 memmap of a DenseRetriever).
+
+        Args:
+            vectors: (n, dim) array of L2-normalized vectors
+            index_dir: Output directory (replaced atomically)
+            nlist: Number of lists. Defaults to about 4 * sqrt(n)
+            train_size: Vectors sampled to train the centroids
+            iterations: k-means iterations
+            seed: Sampling seed (builds are deterministic)
+            fingerprint: Stored in the meta so callers can detect stale indexes
+
+        Returns:
+            IVFIndex instance
+        """
+        start = time.perf_counter()
+        num_vectors, dim = vectors.shape
+        nlist = min(nlist or default_nlist(num_vectors), num_vectors)
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(num_vectors, size=min(train_size, num_vectors), replace=False))
+        sample = np.asarray(vectors[sample_ids], dtype=np.float32)
+        centroids = train_centroids(sample, nlist, iterations, seed)
+
+        assignment = np.empty(num_vectors, dtype=np.int64)
+        for i in range(0, num_vectors, ASSIGN_BLOCK):
+            block = np.asarray(vectors[i:i + ASSIGN_BLOCK], dtype=np.float32)
+            assignment[i:i + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=nlist)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        index_path = Path(index_dir)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f".{index_path.name}.", dir=index_path.parent)
+        try:
+            np.save(os.path.join(staging_dir, "centroids.npy"), centroids)
+            np.save(os.path.join(staging_dir, "list_offsets.npy"), offsets)
+            np.save(os.path.join(staging_dir, "list_ids.npy"), order)
+            grouped = np.lib.format.open_memmap(os.path.join(staging_dir, "list_vectors.npy"), mode='w+',
+                                                dtype=np.float16, shape=(num_vectors, dim))
+            for i in range(0, num_vectors, ASSIGN_BLOCK):
+                grouped[i:i + ASSIGN_BLOCK] = vectors[order[i:i + ASSIGN_BLOCK]]
+            grouped.flush()
+            del grouped
+            with open(os.path.join(staging_dir, IVF_META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'format': IVF_FORMAT_VERSION,
+                    'fingerprint': fingerprint,
+                    'num_vectors': num_vectors,
+                    'dim': dim,
+                    'nlist': nlist,
+                    'train_size': len(sample_ids),
+                    'iterations': iterations,
+                    'seed': seed,
+                }, f, indent=2)
+            if index_path.exists():
+                shutil.rmtree(index_path)
+            os.replace(staging_dir, index_path)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        print(f"Built IVF index: {num_vectors} vectors, {nlist} lists in {time.perf_counter() - start:.2f}s")
+        return cls(index_dir)
+
+    def search(self, query_vectors, top_k=5, nprobe=DEFAULT_NPROBE):
+        """
+        Approximate top_k inner-product search.
+
+        Args:
+            query_vectors: (num_queries, dim) L2-normalized queries
+            top_k: Results per query
+            nprobe: Lists scanned per query (higher = better recall, slower)
+
+        Returns:
+            List of (ids, scores) array pairs, best first, one per query
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_scores = query_vectors @ self.centroids.T
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.nlist), (len(query_vectors), self.nlist))
+
+        results = []
+        for query, lists in zip(query_vectors, probes):
+            # Scan lists in storage order so reads stay sequential
+            rows = np.concatenate([np.arange(self.list_offsets[l], self.list_offsets[l + 1])
+                                   for l in np.sort(lists)])
+            if len(rows) == 0:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            scores = np.asarray(self.list_vectors[rows], dtype=np.float32) @ query
+            k = min(top_k, len(scores))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            results.append((np.asarray(self.list_ids[rows[best]]), scores[best]))
+        return results
@@ -0,0 +1,121 @@
+"""
+Recall / latency benchmark of the IVF index against exact search.
+
+Uses the embedding matrix of a dense index (index_cache/dense_*/embeddings.npy)
+or a synthetic clustered corpus. Queries are corpus vectors with added noise,
+so they behave like paraphrases of indexed chunks.
+
+Example:
+    python My_RAG/benchmark_ann.py --synthetic 200000 --dim 256 --nprobe 1,4,8,16,32 --top_k 10
+    python My_RAG/benchmark_ann.py --index_dir index_cache/dense_en_<fingerprint> --nprobe 2,4,8
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+from ann_index import IVFIndex
+from dense_retriever import EMBEDDINGS_FILE
+
+
+def synthetic_vectors(num_vectors, dim, num_clusters=None, seed=0):
+    """Unit vectors drawn around random cluster centres (float16, like a dense index)."""
+    rng = np.random.default_rng(seed)
+    num_clusters = num_clusters or max(1, num_vectors // 500)
+    centres = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(num_clusters, size=num_vectors)]
+    vectors += 0.6 * rng.normal(size=vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float16)
+
+
+def make_queries(vectors, num_queries, noise=0.3, seed=1):
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = np.asarray(vectors[ids], dtype=np.float32)
+    queries += noise * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_search(vectors, queries, top_k, block=65536):
+    """Brute-force top_k ids per query (the DenseRetriever exact path)."""
+    scores = np.empty((len(vectors), len(queries)), dtype=np.float32)
+    for i in range(0, len(vectors), block):
+        scores[i:i + block] = np.asarray(vectors[i:i + block], dtype=np.float32) @ queries.T
+    top = np.argpartition(-scores, top_k - 1, axis=0)[:top_k].T
+    return [set(row.tolist()) for row in top]
+
+
+def run_benchmark(vectors, nprobes, top_k=10, num_queries=200, nlist=None, index_dir=None):
+    """
+    Returns:
+        (rows, nlist): one {nprobe, recall, mean_ms, p95_ms, qps} row per nprobe after an
+        'exact' row (its latency is amortized over one batched pass)
+    """
+    queries = make_queries(vectors, num_queries)
+    start = time.perf_counter()
+    truth = exact_search(vectors, queries, top_k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    temp_dir = None if index_dir else tempfile.mkdtemp(prefix="ivf_bench_")
+    index = IVFIndex.build(vectors, os.path.join(index_dir or temp_dir, "ivf"), nlist=nlist)
+    rows = [{"nprobe": "exact", "recall": 1.0, "mean_ms": exact_ms, "p95_ms": exact_ms,
+             "qps": 1000 / max(exact_ms, 1e-9)}]
+    for nprobe in nprobes:
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            ids, _ = index.search(query[None, :], top_k=top_k, nprobe=nprobe)[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected.intersection(ids.tolist()))
+        latencies.sort()
+        mean_ms = sum(latencies) / len(latencies)
+        rows.append({
+            "nprobe": nprobe,
+            "recall": hits / (top_k * len(queries)),
+            "mean_ms": mean_ms,
+            "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+            "qps": 1000 / max(mean_ms, 1e-9),
+        })
+    nlist = index.nlist
+    del index
+    if temp_dir:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return rows, nlist
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_dir', help='Dense index directory holding embeddings.npy')
+    parser.add_argument('--synthetic', type=int, default=None, help='Benchmark N synthetic vectors instead')
+    parser.add_argument('--dim', type=int, default=256, help='Dimension of synthetic vectors')
+    parser.add_argument('--nlist', type=int, default=None, help='IVF lists (default: about 4 * sqrt(n))')
+    parser.add_argument('--nprobe', default='1,2,4,8,16,32', help='Comma-separated nprobe values')
+    parser.add_argument('--top_k', type=int, default=10)
+    parser.add_argument('--num_queries', type=int, default=200)
+    parser.add_argument('--output', default=None, help='Optionally save the rows as JSON')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    elif args.index_dir:
+        # The benchmark index goes to a temp dir, leaving the retriever's own IVF index alone
+        vectors = np.load(Path(args.index_dir) / EMBEDDINGS_FILE, mmap_mode='r')
+    else:
+        parser.error("Pass --index_dir or --synthetic")
+
+    nprobes = [int(n) for n in args.nprobe.split(',') if n]
+    rows, nlist = run_benchmark(vectors, nprobes, top_k=args.top_k, num_queries=args.num_queries,
+                                nlist=args.nlist)
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, nlist {nlist}, recall@{args.top_k}")
+    print(f"{'nprobe':>8} {'recall':>8} {'mean_ms':>9} {'p95_ms':>9} {'qps':>9}")
+    for row in rows:
+        print(f"{row['nprobe']:>8} {row['recall']:>8.3f} {row['mean_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['qps']:>9.0f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"num_vectors": len(vectors), "nlist": nlist, "top_k": args.top_k, "rows": rows}, f, indent=2)
@@ -0,0 +1,161 @@
+"""
+Vectorized BM25 (Okapi) over a sparse term-document matrix.
+
+Tokens are mapped to integer ids and the corpus is kept as a CSR matrix of
+term counts. BM25 weights idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+are precomputed once per corpus, so scoring a batch of queries is one sparse
+matrix product and top-k selection is an argpartition.
+
+Scores are identical to rank_bm25.BM25Okapi (same idf with the epsilon floor
+for terms in more than half of the documents; repeated query terms count
+repeatedly).
+"""
+import numpy as np
+from scipy import sparse
+
+
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+DEFAULT_EPSILON = 0.25
+# Queries scored per sparse product; bounds the dense (queries x docs) score block
+DEFAULT_QUERY_BATCH = 256
+
+
+class SparseBM25:
+
+    def __init__(self, k1=DEFAULT_K1, b=DEFAULT_B, epsilon=DEFAULT_EPSILON):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab = {}
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.weights = self.counts
+        self.idf = np.zeros(0, dtype=np.float32)
+
+    @property
+    def num_docs(self):
+        return self.counts.shape[0]
+
+    def _encode(self, tokenized_docs, grow_vocab):
+        """Term-count CSR matrix (len(tokenized_docs) x vocab) of token lists."""
+        indptr = [0]
+        indices = []
+        for tokens in tokenized_docs:
+            for token in tokens:
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    if not grow_vocab:
+                        continue
+                    term_id = self.vocab[token] = len(self.vocab)
+                indices.append(term_id)
+            indptr.append(len(indices))
+        data = np.ones(len(indices), dtype=np.float32)
+        matrix = sparse.csr_matrix((data, np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                                   shape=(len(tokenized_docs), len(self.vocab)))
+        # Duplicate (row, term) entries are summed into counts
+        matrix.sum_duplicates()
+        return matrix
+
+    def fit(self, tokenized_docs):
+        """Indexes a corpus of token lists (replaces any previous corpus)."""
+        self.vocab = {}
+        self.counts = self._encode(tokenized_docs, grow_vocab=True)
+        self.doc_len = np.array([len(tokens) for tokens in tokenized_docs], dtype=np.float64)
+        self._compute_weights()
+        return self
+
+    def update(self, keep_rows, new_tokenized_docs):
+        """
+        Keeps the documents at keep_rows (in that order) and appends new ones,
+        reusing the stored term counts instead of re-tokenizing the corpus.
+        """
+        kept = self.counts[keep_rows]
+        added = self._encode(new_tokenized_docs, grow_vocab=True)
+        kept.resize((kept.shape[0], len(self.vocab)))
+        self.counts = sparse.vstack([kept, added], format='csr')
+        self.doc_len = np.concatenate([self.doc_len[keep_rows],
+                                       np.array([len(tokens) for tokens in new_tokenized_docs], dtype=np.float64)])
+        self._compute_weights()
+        return self
+
+    def _compute_weights(self):
+        num_docs = self.num_docs
+        if num_docs == 0:
+            self.idf = np.zeros(len(self.vocab), dtype=np.float32)
+            self.weights = self.counts
+            return
+        doc_freq = np.bincount(self.counts.indices, minlength=len(self.vocab)).astype(np.float64)
+        idf = np.log(num_docs - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        # Terms seen in the (possibly updated) vocabulary but in no remaining document
+        present = doc_freq > 0
+        average_idf = idf[present].mean() if present.any() else 0.0
+        idf[present & (idf < 0)] = self.epsilon * average_idf
+        idf[~present] = 0.0
+        self.idf = idf
+
+        avgdl = self.doc_len.sum() / num_docs
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / avgdl)
+        tf = self.counts.data.astype(np.float64)
+        rows = np.repeat(np.arange(num_docs), np.diff(self.counts.indptr))
+        data = idf[self.counts.indices] * tf * (self.k1 + 1) / (tf + norm[rows])
+        self.weights = sparse.csr_matrix((data, self.counts.indices, self.counts.indptr), shape=self.counts.shape)
+        # (vocab x docs) so a (queries x vocab) product yields (queries x docs)
+        self._weights_t = self.weights.T.tocsr()
+
+    def get_scores(self, tokenized_query):
+        """Scores of every document for one query (rank_bm25-compatible)."""
+        return self.get_scores_batch([tokenized_query])[0]
+
+    def get_scores_batch(self, tokenized_queries):
+        """Dense (num_queries x num_docs) score matrix from one sparse product."""
+        queries = self._encode(tokenized_queries, grow_vocab=False)
+        if self.num_docs == 0:
+            return np.zeros((len(tokenized_queries), 0))
+        return (queries @ self._weights_t).toarray()
+
+    @staticmethod
+    def top_k(scores, k):
+        """Indices of the k best scores, best first; ties keep document order."""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            # Resolve ties at the cut-off by document order
+            kth = scores[candidates].min()
+            above = np.flatnonzero(scores > kth)
+            tied = np.flatnonzero(scores == kth)[:k - len(above)]
+            candidates = np.concatenate([above, tied])
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+    def search_batch(self, tokenized_queries, k, query_batch=DEFAULT_QUERY_BATCH):
+        """
+        Returns:
+            List of (doc indices, scores) per query, best first
+        """
+        results = []
+        for i in range(0, len(tokenized_queries), query_batch):
+            scores = self.get_scores_batch(tokenized_queries[i:i + query_batch])
+            for row in scores:
+                best = self.top_k(row, k)
+                results.append((best, row[best]))
+        return results
+
+    def search_subset(self, tokenized_query, doc_ids, k):
+        """
+        Scores only the given documents for one query (same scores as a full
+        search, since idf and avgdl stay corpus-wide).
+
+        Returns:
+            (doc indices, scores), best first
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if len(doc_ids) == 0 or self.num_docs == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        query = self._encode([tokenized_query], grow_vocab=False)
+        # Row slicing the (docs x vocab) weights touches only the allowed documents
+        scores = (query @ self.weights[doc_ids].T).toarray()[0]
+        best = self.top_k(scores, k)
+        return doc_ids[best], scores[best]
@@ -0,0 +1,130 @@
+"""
+Compact chunk storage.
+
+A ChunkStore keeps every document's text and metadata exactly once and
+describes each chunk as three integers (document index, start, end) in
+typed arrays. Chunk texts and metadata dicts are only materialized when a
+chunk is accessed, so overlapping chunks cost no duplicated text.
+"""
+from array import array
+from collections.abc import Sequence
+import re
+
+
+# English sentences end in . ? ! followed by whitespace
+EN_SENTENCE_GAP = re.compile(r'(?<=[.?!])\s+')
+
+
+def span_text(text, start, end, language):
+    """
+    Text of the chunk covering text[start:end]. English chunks join their
+    sentences without the whitespace between them, as the sentence chunker
+    always has; Chinese sentences have no gaps, so the span is the text.
+    """
+    if language == 'zh':
+        return text[start:end]
+    return EN_SENTENCE_GAP.sub('', text[start:end])
+
+
+class Chunk:
+    """Lazy view of one chunk; supports the dict-style access used by the pipeline."""
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def page_content(self):
+        store = self.store
+        doc_index = store.doc_index[self.index]
+        return span_text(store.doc_texts[doc_index], store.starts[self.index], store.ends[self.index],
+                         store.doc_metadata[doc_index].get('language'))
+
+    @property
+    def metadata(self):
+        store = self.store
+        metadata = dict(store.doc_metadata[store.doc_index[self.index]])
+        metadata['chunk_index'] = self.index
+        metadata['start_index'] = store.starts[self.index]
+        metadata['end_index'] = store.ends[self.index]
+        return metadata
+
+    def __getitem__(self, key):
+        if key == 'page_content':
+            return self.page_content
+        if key == 'metadata':
+            return self.metadata
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ('page_content', 'metadata')
+
+    def to_dict(self):
+        return {'page_content': self.page_content, 'metadata': self.metadata}
+
+    def __eq__(self, other):
+        return isinstance(other, Chunk) and other.store is self.store and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    def __repr__(self):
+        return f"Chunk(index={self.index}, page_content={self.page_content[:40]!r}...)"
+
+
+class ChunkStore(Sequence):
+    """Array-backed table of chunks: (doc index, start offset, end offset) per chunk."""
+
+    __slots__ = ('doc_texts', 'doc_metadata', 'doc_index', 'starts', 'ends')
+
+    def __init__(self):
+        self.doc_texts = []
+        # Document metadata without 'content', stored once per document
+        self.doc_metadata = []
+        self.doc_index = array('l')
+        self.starts = array('l')
+        self.ends = array('l')
+
+    def add_document(self, doc):
+        """Registers a document and returns its index in the store."""
+        metadata = {k: v for k, v in doc.items() if k != 'content'}
+        self.doc_texts.append(doc['content'])
+        self.doc_metadata.append(metadata)
+        return len(self.doc_texts) - 1
+
+    def add_chunk(self, doc_index, start, end):
+        """Appends a chunk spanning doc_texts[doc_index][start:end] and returns its index."""
+        self.doc_index.append(doc_index)
+        self.starts.append(start)
+        self.ends.append(end)
+        return len(self.starts) - 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Chunk(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Chunk(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Chunk(self, i)
+
+    def nbytes(self):
+        """Approximate payload size: shared document texts plus the span arrays."""
+        text_bytes = sum(len(t.encode('utf-8')) for t in self.doc_texts)
+        span_bytes = sum(a.itemsize * len(a) for a in (self.doc_index, self.starts, self.ends))
+        return text_bytes + span_bytes
@@ -2,92 +2,272 @@
 # 1. Added split_sentences function to split text into sentences based on punctuation.
 # 2. Updated chunk_documents to build chunks from complete sentences to preserve semantic integrity.
 # 3. Implemented sliding window with overlap based on character count.
+# 4. Chunks are computed as character spans, so they can also be kept in a compact ChunkStore.
+# 5. Added semantic_chunk_documents: cuts where adjacent sentences stop being similar (embeddings).
 
+from chunk_store import EN_SENTENCE_GAP, ChunkStore, span_text
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import os
 import re
+import time
 
-def split_sentences(text, language):
-    """Splits text into sentences based on language-specific punctuation."""
+# Bump whenever chunk boundaries or texts change, so indexes keyed by the source file are rebuilt
+CHUNKER_VERSION = 3
+
+_ZH_SENTENCE_END = re.compile(r'[。？！…；]')
+
+def split_sentence_spans(text, language):
+    """Returns (start, end) character offsets of the sentences of text."""
+    spans = []
     if language == 'zh':
         # Split by Chinese punctuation (。, ？, ！, …) and keep the punctuation
         # Added ； (semicolon) as it often separates complete thoughts in lists
-        parts = re.split(r'([。？！…；])', text)
-        sentences = []
-        # Recombine content with its punctuation
-        for i in range(0, len(parts) - 1, 2):
-            sentences.append(parts[i] + parts[i+1])
+        start = 0
+        for m in _ZH_SENTENCE_END.finditer(text):
+            spans.append((start, m.end()))
+            start = m.end()
         # Add the last part if it exists (e.g. text without ending punctuation)
-        if len(parts) % 2 == 1 and parts[-1]:
-            sentences.append(parts[-1])
-        return sentences
+        if start < len(text):
+            spans.append((start, len(text)))
     else:
         # Split by English punctuation (. ? !) followed by whitespace
         # Lookbehind assertion ensures punctuation is kept with the sentence
-        sentences = re.split(r'(?<=[.?!])\s+', text)
-        return [s for s in sentences if s.strip()]
+        start = 0
+        for m in EN_SENTENCE_GAP.finditer(text):
+            spans.append((start, m.start()))
+            start = m.end()
+        spans.append((start, len(text)))
+        spans = [(s, e) for s, e in spans if text[s:e].strip()]
+    return spans
+
+def split_sentences(text, language):
+    """Splits text into sentences based on language-specific punctuation."""
+    return [text[s:e] for s, e in split_sentence_spans(text, language)]
+
+def iter_chunk_spans(text, language, chunk_size=500, chunk_overlap=150, sentence_spans=None):
+    """
+    Yields (start, end) offsets of the chunks of one document.
+
+    Chunks are built from complete sentences up to chunk_size characters; each new
+    chunk starts with the trailing sentences of the previous one that fit in
+    chunk_overlap. A chunk spans text[start:end]; its text is span_text(text, start, end, language).
+    """
+    if sentence_spans is None:
+        sentence_spans = split_sentence_spans(text, language)
+
+    current = []
+    current_len = 0
+    for span in sentence_spans:
+        sentence_len = span[1] - span[0]
+
+        # Check if adding this sentence would exceed the chunk size
+        if current_len + sentence_len > chunk_size and current:
+            # 1. Emit the current chunk
+            yield current[0][0], current[-1][1]
+
+            # 2. Handle Overlap: Keep sentences from the end that fit within chunk_overlap
+            overlap = []
+            overlap_len = 0
+            for s in reversed(current):
+                if overlap_len + (s[1] - s[0]) <= chunk_overlap:
+                    overlap.insert(0, s)
+                    overlap_len += s[1] - s[0]
+                else:
+                    break
+
+            # 3. Start new chunk with overlap + current sentence
+            current = overlap
+            current.append(span)
+            current_len = overlap_len + sentence_len
+        else:
+            # Add sentence to current chunk
+            current.append(span)
+            current_len += sentence_len
+
+    # Emit the last chunk if it has content
+    if current:
+        yield current[0][0], current[-1][1]
+
+def is_chunkable(doc, language):
+    if 'content' not in doc or not isinstance(doc['content'], str) or 'language' not in doc:
+        return False
+    # Only process documents of the target language
+    return doc['language'] == language
+
+def _chunk_shard(args):
+    """Worker: chunk spans for a shard of document texts."""
+    texts, language, chunk_size, chunk_overlap = args
+    return [list(iter_chunk_spans(text, language, chunk_size, chunk_overlap)) for text in texts]
+
+def parallel_chunk_spans(texts, language, chunk_size=500, chunk_overlap=150, workers=None):
+    """
+    Computes chunk spans for every text on a process pool.
+
+    Texts are split into contiguous shards and results come back in input order,
+    so numbering chunks afterwards gives the same chunk_index as a serial run.
+    """
+    workers = workers or os.cpu_count() or 1
+    # A few shards per worker balances uneven document lengths
+    num_shards = min(len(texts), workers * 4) or 1
+    shard_size = -(-len(texts) // num_shards)
+    shards = [(texts[i:i + shard_size], language, chunk_size, chunk_overlap)
+              for i in range(0, len(texts), shard_size)]
+    spans = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard_spans in executor.map(_chunk_shard, shards):
+            spans.extend(shard_spans)
+    return spans
+
+def chunk_documents(docs, language, chunk_size=500, chunk_overlap=150, compact=False, workers=1):
+    """
+    Splits documents of the given language into overlapping sentence-aligned chunks.
+
+    With compact=True a ChunkStore is returned instead of a list of dicts: metadata is
+    kept once per document and chunks are (doc, start, end) spans into the shared text.
+    With workers > 1 documents are chunked on a process pool; the output is
+    identical to the serial one.
+    """
+    start_time = time.perf_counter()
+    if workers and workers > 1:
+        docs = [doc for doc in docs if is_chunkable(doc, language)]
+        spans = parallel_chunk_spans([doc['content'] for doc in docs], language,
+                                     chunk_size, chunk_overlap, workers)
+        chunks = _assemble_chunks(docs, spans, compact)
+    elif compact:
+        chunks = build_chunk_store(docs, language, chunk_size, chunk_overlap)
+    else:
+        chunks = list(iter_chunks(docs, language, chunk_size, chunk_overlap))
+    elapsed = time.perf_counter() - start_time
+    print(f"Chunked into {len(chunks)} chunks in {elapsed:.2f}s "
+          f"({len(chunks) / max(elapsed, 1e-9):.0f} chunks/sec, {workers or 1} workers)")
+    return chunks
+
+def _assemble_chunks(docs, spans_per_doc, compact):
+    """Numbers chunks in document order, exactly as the serial chunkers do."""
+    if compact:
+        store = ChunkStore()
+        for doc, spans in zip(docs, spans_per_doc):
+            doc_index = store.add_document(doc)
+            for start, end in spans:
+                store.add_chunk(doc_index, start, end)
+        return store
 
-def chunk_documents(docs, language, chunk_size=500, chunk_overlap=150):
     chunks = []
-    for doc_index, doc in enumerate(docs):
-        if 'content' not in doc or not isinstance(doc['content'], str) or 'language' not in doc:
+    for doc, spans in zip(docs, spans_per_doc):
+        text = doc['content']
+        for start, end in spans:
+            chunks.append(make_chunk(doc, text, start, end, len(chunks)))
+    return chunks
+
+def iter_semantic_spans(sentence_spans, similarities, max_chunk_size=500, similarity_threshold=0.4):
+    """
+    Yields (start, end) offsets of semantic chunks of one document.
+
+    Consecutive sentences are grouped until the similarity between a sentence and
+    the previous one (similarities[i] is between sentences i and i+1) falls below
+    similarity_threshold, or the chunk would grow past max_chunk_size characters.
+    """
+    current_start = current_end = None
+    for i, (start, end) in enumerate(sentence_spans):
+        if current_start is not None:
+            topic_shift = similarities[i - 1] < similarity_threshold
+            too_long = end - current_start > max_chunk_size
+            if topic_shift or too_long:
+                yield current_start, current_end
+                current_start = None
+        if current_start is None:
+            current_start = start
+        current_end = end
+    if current_start is not None:
+        yield current_start, current_end
+
+def adjacent_similarities(embeddings):
+    """Cosine similarity of every row with the next one, computed for all rows at once."""
+    if len(embeddings) < 2:
+        return np.zeros(0, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.maximum(norms, 1e-12)
+    return np.einsum('ij,ij->i', unit[:-1], unit[1:])
+
+def semantic_chunk_documents(docs, language, max_chunk_size=500, similarity_threshold=0.4, compact=False,
+                             embed=None, batch_size=256):
+    """
+    Splits documents into chunks of consecutive, semantically similar sentences.
+
+    Every sentence of the corpus is embedded up front (deduplicated, cached by hash
+    and sent in batches of batch_size), and adjacent-sentence similarities are
+    computed in one vectorized pass over the concatenated sentences.
+
+    Args:
+        docs: Documents; only those of the given language are chunked
+        language: Language code ('en' or 'zh')
+        max_chunk_size: Maximum chunk length in characters (a longer single sentence stays whole)
+        similarity_threshold: A new chunk starts where cosine similarity drops below this
+        compact: Return a ChunkStore instead of a list of dicts
+        embed: Optional callable(list of str) -> (n, dim) array. Defaults to the
+            Ollama embedding model of the shared LLM client
+        batch_size: Sentences per embedding request
+    """
+    start_time = time.perf_counter()
+    docs = [doc for doc in docs if is_chunkable(doc, language)]
+    sentence_spans = [split_sentence_spans(doc['content'], language) for doc in docs]
+    sentences = [doc['content'][s:e].strip() or doc['content'][s:e]
+                 for doc, spans in zip(docs, sentence_spans) for s, e in spans]
+
+    if embed is None:
+        from utils import get_llm_client
+        client = get_llm_client()
+        embed = lambda texts: client.embed(texts, batch_size=batch_size)
+    similarities = adjacent_similarities(embed(sentences)) if sentences else np.zeros(0)
+    embed_elapsed = time.perf_counter() - start_time
+
+    spans_per_doc = []
+    offset = 0
+    for spans in sentence_spans:
+        # Pairs inside this document; the pair spanning two documents is skipped
+        doc_similarities = similarities[offset:offset + max(len(spans) - 1, 0)]
+        spans_per_doc.append(list(iter_semantic_spans(spans, doc_similarities, max_chunk_size,
+                                                      similarity_threshold)))
+        offset += len(spans)
+    chunks = _assemble_chunks(docs, spans_per_doc, compact)
+    elapsed = time.perf_counter() - start_time
+    print(f"Semantically chunked {len(sentences)} sentences into {len(chunks)} chunks in {elapsed:.2f}s "
+          f"(embedding {embed_elapsed:.2f}s)")
+    return chunks
+
+def make_chunk(doc, text, start, end, chunk_index):
+    chunk_metadata = doc.copy()
+    chunk_metadata.pop('content', None)
+    chunk_metadata['chunk_index'] = chunk_index
+    chunk_metadata['start_index'] = start
+    chunk_metadata['end_index'] = end
+    return {
+        'page_content': span_text(text, start, end, doc.get('language')),
+        'metadata': chunk_metadata
+    }
+
+def iter_chunks(docs, language, chunk_size=500, chunk_overlap=150):
+    """Generator version of chunk_documents: yields chunks one at a time, so
+    documents can be streamed from disk straight into the indexer."""
+    num_chunks = 0
+    for doc in docs:
+        if not is_chunkable(doc, language):
             continue
-            
+
         text = doc['content']
-        lang = doc['language']
-        
-        # Only process documents of the target language
-        if lang != language:
+        for start, end in iter_chunk_spans(text, language, chunk_size, chunk_overlap):
+            yield make_chunk(doc, text, start, end, num_chunks)
+            num_chunks += 1
+
+def build_chunk_store(docs, language, chunk_size=500, chunk_overlap=150):
+    """Chunks documents into a compact ChunkStore."""
+    store = ChunkStore()
+    for doc in docs:
+        if not is_chunkable(doc, language):
             continue
-            
-        sentences = split_sentences(text, lang)
-        
-        current_chunk_sentences = []
-        current_chunk_len = 0
-        
-        for sentence in sentences:
-            sentence_len = len(sentence)
-            
-            # Check if adding this sentence would exceed the chunk size
-            if current_chunk_len + sentence_len > chunk_size and current_chunk_sentences:
-                # 1. Save the current chunk
-                chunk_text = "".join(current_chunk_sentences)
-                chunk_metadata = doc.copy()
-                chunk_metadata.pop('content', None)
-                chunk_metadata['chunk_index'] = len(chunks)
-                
-                chunks.append({
-                    'page_content': chunk_text,
-                    'metadata': chunk_metadata
-                })
-                
-                # 2. Handle Overlap: Keep sentences from the end that fit within chunk_overlap
-                overlap_sentences = []
-                overlap_len = 0
-                for s in reversed(current_chunk_sentences):
-                    if overlap_len + len(s) <= chunk_overlap:
-                        overlap_sentences.insert(0, s)
-                        overlap_len += len(s)
-                    else:
-                        break
-                
-                # 3. Start new chunk with overlap + current sentence
-                current_chunk_sentences = overlap_sentences
-                current_chunk_sentences.append(sentence)
-                current_chunk_len = overlap_len + sentence_len
-                
-            else:
-                # Add sentence to current chunk
-                current_chunk_sentences.append(sentence)
-                current_chunk_len += sentence_len
-        
-        # Add the last chunk if it has content
-        if current_chunk_sentences:
-            chunk_text = "".join(current_chunk_sentences)
-            chunk_metadata = doc.copy()
-            chunk_metadata.pop('content', None)
-            chunk_metadata['chunk_index'] = len(chunks)
-            chunks.append({
-                'page_content': chunk_text,
-                'metadata': chunk_metadata
-            })
-            
-    return chunks
+
+        doc_index = store.add_document(doc)
+        for start, end in iter_chunk_spans(doc['content'], language, chunk_size, chunk_overlap):
+            store.add_chunk(doc_index, start, end)
+    return store
@@ -0,0 +1,115 @@
+"""
+Token-budgeted context packing for the generation prompt.
+
+Counts tokens with the model's tokenizer when one is configured (HuggingFace
+`tokenizers`, optional), otherwise with a script-aware estimator, and fills
+the budget with whole chunks; a chunk that does not fit contributes its
+leading whole sentences, and later chunks that still fit are packed whole.
+"""
+from functools import lru_cache
+import math
+import re
+
+from chunker import split_sentences
+
+
+DEFAULT_NUM_CTX = 4096
+# Tokens kept free for tokenizer mismatch and chat-template overhead
+CONTEXT_SAFETY_MARGIN = 64
+CONTEXT_SEPARATOR = "\n\n"
+
+_CJK_RE = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+_WORD_RE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+# English chunk texts join sentences without whitespace ("rose.Beta"), so a sentence
+# may end right before the next one; a digit after the dot is a decimal ("3.5")
+_EN_SENTENCE_END = re.compile(r"(?<=[.?!])\s*(?=[^\s\d])")
+
+
+class TokenCounter:
+    """Counts tokens with a real tokenizer if available, else estimates them."""
+
+    def __init__(self, tokenizer_name: str = None):
+        self.tokenizer = None
+        if tokenizer_name:
+            try:
+                from tokenizers import Tokenizer
+                self.tokenizer = Tokenizer.from_pretrained(tokenizer_name)
+            except Exception as e:
+                print(f"Warning: could not load tokenizer '{tokenizer_name}', using estimator: {e}")
+        # Per-instance memo; chunk texts repeat across queries
+        self.count = lru_cache(maxsize=65536)(self._count)
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return estimate_tokens(text)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Conservative BPE estimate: ~1.3 tokens per CJK character (plus full-width
+    punctuation), ~1.3 per Latin word, 1 per symbol and per three digits.
+    """
+    cjk = len(_CJK_RE.findall(text))
+    other = _CJK_RE.sub(" ", text)
+    tokens = cjk * 1.3
+    for piece in _WORD_RE.findall(other):
+        if piece[0].isalpha():
+            tokens += 1.3
+        elif piece[0].isdigit():
+            # Long numbers are split into groups of a few digits
+            tokens += max(1, len(piece) / 3)
+        else:
+            tokens += 1
+    return int(math.ceil(tokens))
+
+
+@lru_cache(maxsize=8)
+def get_token_counter(tokenizer_name: str = None) -> TokenCounter:
+    return TokenCounter(tokenizer_name)
+
+
+def chunk_sentences(content: str, language: str) -> list:
+    """Sentences of a chunk text, each keeping its trailing whitespace, so they join back with ""."""
+    if language == 'zh':
+        return split_sentences(content, language)
+    sentences = []
+    start = 0
+    for m in _EN_SENTENCE_END.finditer(content):
+        if start < m.end() < len(content):
+            sentences.append(content[start:m.end()])
+            start = m.end()
+    sentences.append(content[start:])
+    return sentences
+
+
+def pack_context(chunks, budget_tokens: int, language: str, counter: TokenCounter) -> str:
+    """
+    Concatenates chunk texts until budget_tokens is used up. A chunk that no
+    longer fits is cut at a sentence boundary rather than mid-sentence, and
+    later (shorter) chunks that still fit are packed after it.
+    """
+    parts = []
+    used = 0
+    sep_tokens = counter.count(CONTEXT_SEPARATOR)
+    for chunk in chunks:
+        content = chunk['page_content']
+        cost = counter.count(content) + (sep_tokens if parts else 0)
+        if used + cost <= budget_tokens:
+            parts.append(content)
+            used += cost
+            continue
+
+        # Fill what is left with whole sentences of this chunk
+        partial = []
+        for sentence in chunk_sentences(content, language):
+            cost = counter.count(sentence) + (sep_tokens if parts and not partial else 0)
+            if used + cost > budget_tokens:
+                break
+            partial.append(sentence)
+            used += cost
+        if partial:
+            parts.append("".join(partial).rstrip())
+    return CONTEXT_SEPARATOR.join(parts)
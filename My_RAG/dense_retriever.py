@@ -0,0 +1,302 @@
+from pathlib import Path
+from ann_index import DEFAULT_NPROBE, IVFIndex
+from utils import get_llm_client
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+
+DEFAULT_INDEX_CACHE = Path(__file__).parent.parent / "index_cache"
+DENSE_META_FILE = "dense_meta.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+DENSE_FORMAT_VERSION = 1
+DEFAULT_EMBED_BATCH_SIZE = 256
+# Rows upcast to float32 per matrix product; bounds the scratch memory of a search
+DEFAULT_SCORE_BLOCK = 65536
+IVF_DIR = "ivf"
+
+
+class DenseRetriever:
+
+    def __init__(self, chunks, language="en", model=None, index_dir=None, cache_dir=None, chunk_params=None,
+                 batch_size=DEFAULT_EMBED_BATCH_SIZE, score_block=DEFAULT_SCORE_BLOCK, ann=None, nlist=None,
+                 nprobe=DEFAULT_NPROBE):
+        """
+        Initialize dense retriever.
+
+        Chunk embeddings are L2-normalized and stored as a float16 .npy matrix in
+        the index cache. A cached matrix is opened with mmap (zero-copy, nothing is
+        re-embedded); queries are scored with a matrix product in float32 blocks.
+
+        Args:
+            chunks: List (or ChunkStore) of document chunks with 'page_content' field
+            language: Language code ('en' or 'zh')
+            model: Ollama embedding model. Defaults to the client's embed_model
+            index_dir: Optional path to save/load the matrix. If None, the index cache is used
+            cache_dir: Root of the index cache. Defaults to DEFAULT_INDEX_CACHE
+            chunk_params: Chunking parameters, part of the cache key
+            batch_size: Chunks per embedding request
+            score_block: Matrix rows scored per block
+            ann: None for exact search, or 'ivf' for an approximate IVF index
+                 (built once next to the matrix and memory-mapped on later runs)
+            nlist: IVF lists (defaults to about 4 * sqrt(num_chunks))
+            nprobe: IVF lists scanned per query; the recall-vs-latency knob
+        """
+        self.chunks = chunks
+        self.language = language
+        self.client = get_llm_client()
+        self.model = model or self.client.embed_model
+        self.chunk_params = chunk_params or {}
+        self.batch_size = batch_size
+        self.score_block = score_block
+        self.nprobe = nprobe
+        self.fingerprint = self._compute_fingerprint()
+
+        if index_dir:
+            self.index_dir = str(index_dir)
+        else:
+            cache_root = Path(cache_dir) if cache_dir else DEFAULT_INDEX_CACHE
+            self.index_dir = str(cache_root / f"dense_{language}_{self.fingerprint[:16]}")
+        print(f"Dense index directory: {self.index_dir}")
+
+        if not self._index_exists():
+            print(f"Embedding {len(chunks)} chunks with {self.model}...")
+            self._build_index()
+        else:
+            print(f"Loading cached embeddings (fingerprint {self.fingerprint[:16]})...")
+
+        # Zero-copy: pages are read from disk on demand and shared between processes
+        self.embeddings = np.load(os.path.join(self.index_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        print(f"Dense retriever initialized with {self.embeddings.shape[0]} chunks "
+              f"(dim {self.embeddings.shape[1]}, {self.embeddings.nbytes / 2**20:.1f} MiB float16).")
+
+        self.ann_index = None
+        if ann == "ivf":
+            ivf_dir = os.path.join(self.index_dir, IVF_DIR)
+            # The IVF index is keyed by nlist too, so changing it rebuilds
+            ivf_fingerprint = f"{self.fingerprint}:nlist={nlist}"
+            if IVFIndex.exists(ivf_dir, ivf_fingerprint):
+                self.ann_index = IVFIndex(ivf_dir)
+            else:
+                self.ann_index = IVFIndex.build(self.embeddings, ivf_dir, nlist=nlist, fingerprint=ivf_fingerprint)
+            print(f"Using IVF index with {self.ann_index.nlist} lists, nprobe={self.nprobe}.")
+        elif ann is not None:
+            raise ValueError(f"Unknown ANN index type: {ann}")
+
+    def _compute_fingerprint(self):
+        """Hash of the embedding model, chunking parameters and chunk texts"""
+        h = hashlib.sha256()
+        header = {
+            'format': DENSE_FORMAT_VERSION,
+            'model': self.model,
+            'language': self.language,
+            'chunk_params': self.chunk_params,
+            'num_chunks': len(self.chunks),
+        }
+        h.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+        for chunk in self.chunks:
+            text = chunk['page_content'].encode('utf-8')
+            h.update(len(text).to_bytes(8, 'little'))
+            h.update(text)
+        return h.hexdigest()
+
+    def _index_exists(self):
+        meta_path = Path(self.index_dir) / DENSE_META_FILE
+        if not meta_path.exists():
+            return False
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if meta.get('fingerprint') != self.fingerprint:
+            print("Dense index fingerprint mismatch, rebuilding...")
+            return False
+        return True
+
+    def _embed(self, texts):
+        """Embeds texts and L2-normalizes the rows (dot product == cosine similarity)"""
+        vectors = self.client.embed(texts, model=self.model, batch_size=self.batch_size)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _build_index(self):
+        """Embeds chunks batch by batch straight into a float16 memory-mapped matrix"""
+        index_path = Path(self.index_dir)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f".{index_path.name}.", dir=index_path.parent)
+
+        try:
+            start = time.perf_counter()
+            matrix = None
+            num_chunks = len(self.chunks)
+            for i in range(0, num_chunks, self.batch_size):
+                texts = [self.chunks[j]['page_content'] for j in range(i, min(i + self.batch_size, num_chunks))]
+                vectors = self._embed(texts)
+                if matrix is None:
+                    # The dimension is only known after the first batch
+                    matrix = np.lib.format.open_memmap(os.path.join(staging_dir, EMBEDDINGS_FILE), mode='w+',
+                                                       dtype=np.float16, shape=(num_chunks, vectors.shape[1]))
+                matrix[i:i + len(texts)] = vectors.astype(np.float16)
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(os.path.join(staging_dir, EMBEDDINGS_FILE), mode='w+',
+                                                   dtype=np.float16, shape=(0, 0))
+            matrix.flush()
+            dim = matrix.shape[1]
+            del matrix
+
+            elapsed = time.perf_counter() - start
+            print(f"Embedded {num_chunks} chunks in {elapsed:.2f}s "
+                  f"({num_chunks / max(elapsed, 1e-9):.0f} chunks/sec)")
+
+            with open(os.path.join(staging_dir, DENSE_META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'fingerprint': self.fingerprint,
+                    'model': self.model,
+                    'language': self.language,
+                    'chunk_params': self.chunk_params,
+                    'num_chunks': num_chunks,
+                    'dim': dim,
+                    'dtype': 'float16',
+                }, f, ensure_ascii=False, indent=2)
+            if index_path.exists():
+                shutil.rmtree(index_path)
+            os.replace(staging_dir, index_path)
+
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _score(self, query_vectors):
+        """Cosine scores of all chunks against query_vectors (num_queries, dim) -> (num_chunks, num_queries)"""
+        num_chunks = self.embeddings.shape[0]
+        scores = np.empty((num_chunks, query_vectors.shape[0]), dtype=np.float32)
+        query_t = query_vectors.T.astype(np.float32)
+        for i in range(0, num_chunks, self.score_block):
+            # NumPy has no fast float16 matmul; upcast one block at a time
+            block = np.asarray(self.embeddings[i:i + self.score_block], dtype=np.float32)
+            scores[i:i + len(block)] = block @ query_t
+        return scores
+
+    @staticmethod
+    def _top_k(scores, top_k):
+        """Indices of the top_k scores, best first (argpartition, then sort only the k winners)"""
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    def cache_settings(self):
+        """Search settings that change results, for result caches"""
+        return {
+            'retriever': 'dense',
+            'language': self.language,
+            'model': self.model,
+            'ann': None if self.ann_index is None else 'ivf',
+            'nlist': None if self.ann_index is None else self.ann_index.nlist,
+            'nprobe': self.nprobe,
+        }
+
+    def retrieve(self, query, top_k=5, allowed_ids=None):
+        """
+        Retrieve top-k most relevant chunks for a query.
+
+        Args:
+            query: Query string
+            top_k: Number of top results to return
+            allowed_ids: Optional chunk positions to search instead of all chunks
+
+        Returns:
+            List of top-k chunks
+        """
+        return [chunk for chunk, _ in self.retrieve_with_scores(query, top_k, allowed_ids=allowed_ids)]
+
+    def retrieve_with_scores(self, query, top_k=5, allowed_ids=None):
+        """
+        Retrieve top-k chunks with their cosine similarity scores.
+
+        Args:
+            query: Query string
+            top_k: Number of top results to return
+            allowed_ids: Optional chunk positions to search instead of all chunks
+
+        Returns:
+            List of tuples (chunk, score)
+        """
+        return self.retrieve_batch([query], top_k=top_k, with_scores=True,
+                                   allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def _results(self, ids, scores, with_scores):
+        return [(self.chunks[int(idx)], float(score)) if with_scores else self.chunks[int(idx)]
+                for idx, score in zip(ids, scores)]
+
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        """
+        Retrieves top_k chunks for every query with one embedding call and one
+        pass over the matrix.
+
+        Args:
+            queries: List of query strings
+            top_k: Number of results per query
+            threads: Unused; accepted for interface parity (BLAS threads the product)
+            with_scores: Return (chunk, score) tuples instead of chunks
+            allowed_ids: Optional list with, per query, the chunk positions it may
+                return (None: all). Those queries score only their rows, exactly.
+
+        Returns:
+            List of result lists, in the same order as queries
+        """
+        if not queries or self.embeddings.shape[0] == 0:
+            return [[] for _ in queries]
+        allowed_ids = allowed_ids or [None] * len(queries)
+        query_vectors = self._embed(list(queries))
+        all_results = [None] * len(queries)
+
+        for q, ids in enumerate(allowed_ids):
+            if ids is None:
+                continue
+            ids = np.asarray(ids, dtype=np.int64)
+            column = np.asarray(self.embeddings[ids], dtype=np.float32) @ query_vectors[q].astype(np.float32)
+            best = self._top_k(column, top_k)
+            all_results[q] = self._results(ids[best], column[best], with_scores)
+
+        unfiltered = [q for q, ids in enumerate(allowed_ids) if ids is None]
+        if not unfiltered:
+            return all_results
+        if self.ann_index is not None:
+            for q, (ids, scores) in zip(unfiltered, self.ann_index.search(query_vectors[unfiltered], top_k,
+                                                                          self.nprobe)):
+                all_results[q] = self._results(ids, scores, with_scores)
+            return all_results
+
+        scores = self._score(query_vectors[unfiltered])
+        for column_index, q in enumerate(unfiltered):
+            column = scores[:, column_index]
+            best = self._top_k(column, top_k)
+            all_results[q] = self._results(best, column[best], with_scores)
+        return all_results
+
+
+def create_dense_retriever(chunks, language, model=None, chunk_params=None, cache_dir=None, ann=None,
+                           nprobe=DEFAULT_NPROBE):
+    """
+    Creates a dense retriever from document chunks.
+
+    Args:
+        chunks: List of document chunks
+        language: Language code ('en' or 'zh')
+        model: Ollama embedding model (defaults to embed_model in the config)
+        chunk_params: Chunking parameters, included in the cache key
+        cache_dir: Root of the index cache (defaults to ./index_cache)
+        ann: None for exact search or 'ivf' for approximate search
+        nprobe: IVF lists scanned per query
+
+    Returns:
+        DenseRetriever instance
+    """
+    return DenseRetriever(chunks, language, model=model, chunk_params=chunk_params, cache_dir=cache_dir,
+                          ann=ann, nprobe=nprobe)
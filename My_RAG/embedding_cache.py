@@ -0,0 +1,82 @@
+"""
+Persistent cache for text embeddings.
+
+Vectors are stored as float32 blobs in a SQLite database keyed by a hash of
+(model, text), so sentences that were embedded once (in any run) are never
+sent to the embedding model again.
+"""
+from pathlib import Path
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+
+DEFAULT_EMBEDDING_CACHE_PATH = Path(__file__).parent.parent / "llm_cache" / "embeddings.sqlite"
+# SQLite limits the number of host parameters per statement
+_LOOKUP_BATCH = 500
+
+
+def make_embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+
+    def __init__(self, path=DEFAULT_EMBEDDING_CACHE_PATH):
+        """
+        Args:
+            path: SQLite file holding the cached vectors
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: list) -> dict:
+        """Returns {key: float32 vector} for the keys that are cached."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[i:i + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Stores (key, vector) pairs."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"Embedding cache: hits={self.hits} misses={self.misses} hit_rate={rate:.1%}"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
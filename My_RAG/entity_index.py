@@ -0,0 +1,284 @@
+"""
+Entity prefilter: finds the company / court / patient names a query mentions
+and restricts retrieval to the chunks of the matching documents.
+
+Names come from the document metadata and are compiled once into an
+Aho-Corasick automaton, so matching a query costs one pass over its
+characters no matter how many names are indexed.
+"""
+from collections import deque
+import re
+
+
+# Metadata fields holding the entity a document is about (Finance, Law, Medical)
+ENTITY_FIELDS = ("company_name", "court_name", "hospital_patient_name")
+# hospital_patient_name joins the hospital and the patient ("Hospital_X. Name")
+_ALIAS_SEPARATOR = "_"
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_name(text):
+    """Case-folds and collapses whitespace; trailing dots are dropped so
+    "Ltd." also matches "Ltd" and "Ltd.'s"."""
+    return _WHITESPACE.sub(" ", text.casefold()).strip().rstrip(".")
+
+
+def name_aliases(name):
+    """Normalized strings that identify a metadata name in a query."""
+    aliases = {normalize_name(name)}
+    if _ALIAS_SEPARATOR in name:
+        aliases.update(normalize_name(part) for part in name.split(_ALIAS_SEPARATOR))
+    return {alias for alias in aliases if alias}
+
+
+def _is_word_char(char):
+    return char.isascii() and char.isalnum()
+
+
+class AhoCorasick:
+
+    def __init__(self, patterns):
+        """
+        Compiles the patterns into a trie with failure links.
+
+        Args:
+            patterns: Iterable of (already normalized) strings
+        """
+        self.patterns = list(dict.fromkeys(patterns))
+        self._goto = [{}]
+        self._fail = [0]
+        # Pattern ids ending at each node, including those reached through failure links
+        self._output = [[]]
+        for pattern_id, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append(pattern_id)
+
+        # Breadth-first, so a node's failure target is final before its children use it
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text):
+        """
+        Returns:
+            List of (start, end, pattern) for every occurrence in text
+        """
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for pattern_id in self._output[node]:
+                pattern = self.patterns[pattern_id]
+                matches.append((i + 1 - len(pattern), i + 1, pattern))
+        return matches
+
+
+class EntityIndex:
+
+    def __init__(self, chunks, fields=ENTITY_FIELDS):
+        """
+        Maps every entity name in the chunk metadata to the chunks it owns.
+
+        Chunk ids are positions in `chunks`, which is also how the retrievers
+        number them, so the index must be rebuilt when the chunks change.
+
+        Args:
+            chunks: List (or ChunkStore) of chunk dictionaries
+            fields: Metadata fields holding entity names
+        """
+        self.fields = tuple(fields)
+        # name -> sorted chunk ids; alias -> names
+        self.chunk_ids = {}
+        self.domains = {}
+        alias_names = {}
+        for chunk_id, chunk in enumerate(chunks):
+            metadata = chunk.get('metadata') or {}
+            for field in self.fields:
+                name = metadata.get(field)
+                if not name:
+                    continue
+                self.chunk_ids.setdefault(name, []).append(chunk_id)
+                self.domains.setdefault(name, metadata.get('domain'))
+                for alias in name_aliases(name):
+                    alias_names.setdefault(alias, set()).add(name)
+        self.num_chunks = len(chunks)
+        self._alias_names = {alias: sorted(names) for alias, names in alias_names.items()}
+        self._automaton = AhoCorasick(self._alias_names)
+        print(f"Entity index: {len(self.chunk_ids)} names, {len(self._alias_names)} aliases")
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def match(self, query):
+        """
+        Finds the indexed names a query mentions.
+
+        English aliases must start and end on word boundaries ("Acme" does not
+        match inside "Acmeville"); an alias contained in a longer matched alias
+        (a hospital inside "Hospital_Patient") is dropped.
+
+        Returns:
+            List of metadata names, in order of first mention
+        """
+        text = normalize_name(query)
+        spans = []
+        for start, end, alias in self._automaton.find(text):
+            if _is_word_char(alias[0]) and start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if _is_word_char(alias[-1]) and end < len(text) and _is_word_char(text[end]):
+                continue
+            spans.append((start, end, alias))
+
+        # Longest first, then keep spans not covered by an already kept span
+        spans.sort(key=lambda span: (span[0] - span[1], span[0]))
+        kept = []
+        for start, end, alias in spans:
+            if not any(kept_start <= start and end <= kept_end for kept_start, kept_end, _ in kept):
+                kept.append((start, end, alias))
+        kept.sort()
+
+        names = []
+        for _, _, alias in kept:
+            names.extend(name for name in self._alias_names[alias] if name not in names)
+        return names
+
+    def allowlist(self, query):
+        """
+        Chunk ids of the entities a query names.
+
+        Returns:
+            Sorted list of chunk ids, or None when the query names no entity
+            (search the whole corpus)
+        """
+        names = self.match(query)
+        if not names:
+            return None
+        if len(names) == 1:
+            return self.chunk_ids[names[0]]
+        return sorted({chunk_id for name in names for chunk_id in self.chunk_ids[name]})
+
+
+class EntityFilteredRetriever:
+
+    def __init__(self, retriever, entity_index, filtered_top_k=None):
+        """
+        Wraps a retriever so queries naming an entity only search its chunks.
+
+        Args:
+            retriever: Any retriever whose retrieve / retrieve_batch accept allowed_ids
+            entity_index: EntityIndex over the retriever's chunks
+            filtered_top_k: Results searched for and returned on filtered queries (default: top_k).
+                The candidate set is already narrow, so fewer chunks are usually enough.
+        """
+        self.retriever = retriever
+        self.entity_index = entity_index
+        self.filtered_top_k = filtered_top_k
+        self.stats = {"queries": 0, "filtered": 0, "candidates": 0}
+
+    def __getattr__(self, name):
+        # Everything else (timing_summary, update_documents, ...) goes to the wrapped retriever
+        return getattr(self.retriever, name)
+
+    def allowlists(self, queries):
+        """
+        Chunk allowlists of the entities each query names (None: no entity).
+
+        Match on the user's own query text: an LLM expansion can invent names
+        and narrow a query that named no entity.
+        """
+        return [self.entity_index.allowlist(query) for query in queries]
+
+    def _top_k(self, allowed_ids, top_k):
+        if allowed_ids is None or not self.filtered_top_k:
+            return top_k
+        return min(top_k, self.filtered_top_k)
+
+    def cache_settings(self):
+        """Filter settings and the wrapped retriever's settings, for result caches"""
+        return {'entity_filter': list(self.entity_index.fields), 'filtered_top_k': self.filtered_top_k,
+                'retriever': self.retriever.cache_settings()}
+
+    def retrieve(self, query, top_k=5, allowed_ids=None):
+        return self.retrieve_batch([query], top_k=top_k, allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def retrieve_with_scores(self, query, top_k=5, allowed_ids=None):
+        return self.retrieve_batch([query], top_k=top_k, with_scores=True,
+                                   allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        """
+        Retrieves top_k chunks per query (filtered_top_k for filtered queries),
+        searching only the named entities' chunks when the query names any and
+        the whole corpus otherwise.
+
+        Args:
+            allowed_ids: Optional per-query allowlists from allowlists(); computed
+                from queries when omitted
+
+        Returns:
+            List of result lists, in the same order as queries
+        """
+        if not queries:
+            return []
+        allowlists = allowed_ids if allowed_ids is not None else self.allowlists(queries)
+        filtered = [ids for ids in allowlists if ids is not None]
+        self.stats["queries"] += len(queries)
+        self.stats["filtered"] += len(filtered)
+        self.stats["candidates"] += sum(len(ids) for ids in filtered)
+
+        # One search per result size, so filtered queries are searched at the reduced k
+        by_k = {}
+        for i, ids in enumerate(allowlists):
+            by_k.setdefault(self._top_k(ids, top_k), []).append(i)
+        all_results = [None] * len(queries)
+        for k, positions in by_k.items():
+            kwargs = {}
+            if any(allowlists[i] is not None for i in positions):
+                kwargs["allowed_ids"] = [allowlists[i] for i in positions]
+            results = self.retriever.retrieve_batch([queries[i] for i in positions], top_k=k, threads=threads,
+                                                    with_scores=with_scores, **kwargs)
+            for i, result in zip(positions, results):
+                all_results[i] = result
+        return all_results
+
+    def filter_summary(self) -> str:
+        queries, filtered = self.stats["queries"], self.stats["filtered"]
+        if not queries:
+            return "Entity filter: no queries"
+        mean_candidates = self.stats["candidates"] / filtered if filtered else 0
+        return (f"Entity filter: {filtered}/{queries} queries filtered, "
+                f"{mean_candidates:.0f} of {self.entity_index.num_chunks} chunks searched on average")
+
+
+def create_entity_filtered_retriever(retriever, chunks, filtered_top_k=None):
+    """
+    Wraps a retriever with an entity prefilter built from its chunks.
+
+    Args:
+        retriever: PyseriniRetriever, BM25Retriever, DenseRetriever or HybridRetriever
+        chunks: The chunks the retriever was built from, in the same order
+        filtered_top_k: Results returned for queries that name an entity
+
+    Returns:
+        EntityFilteredRetriever instance
+    """
+    return EntityFilteredRetriever(retriever, EntityIndex(chunks), filtered_top_k=filtered_top_k)
@@ -1,36 +1,86 @@
-from utils import llm_generate
+from context_packer import pack_context, get_token_counter, DEFAULT_NUM_CTX, CONTEXT_SAFETY_MARGIN
+from selector import load_templates
+from utils import llm_generate, llm_generate_async, get_llm_client
 
+# Answer token caps: sent as num_predict and reserved out of num_ctx when packing context
+TEMPLATE_TOKEN_BUDGETS = {
+    "qa_expert.txt": 256,
+    "comparison.txt": 384,
+    "data_extraction.txt": 512,
+    "summary_report.txt": 512,
+}
+DEFAULT_TOKEN_BUDGET = 512
 
-def generate_answer(query, context_chunks, prompt_template, language):
-    # context = "\n\n".join([chunk['page_content'] for chunk in context_chunks])
-    
-    # Truncate context to avoid exceeding token limit (approx 2000 chars safe for 4096 tokens)
-    MAX_CONTEXT_LEN = 3000
-    current_context = ""
-    for chunk in context_chunks:
-        content = chunk['page_content']
-        if len(current_context) + len(content) < MAX_CONTEXT_LEN:
-            current_context += content + "\n\n"
-        else:
-            # Add partial content if possible, or just break
-            remaining = MAX_CONTEXT_LEN - len(current_context)
-            if remaining > 50: # Only add if meaningful amount remains
-                current_context += content[:remaining] + "..."
-            break
-            
-    context = current_context.strip()
-    prompt_template = prompt_template.replace("{query}", query).replace("{context}", context)
-    
+
+def token_budget(prompt_template):
+    """Returns the answer token budget for a template from template_pool."""
+    for name, content in load_templates().items():
+        if content == prompt_template:
+            return TEMPLATE_TOKEN_BUDGETS.get(name, DEFAULT_TOKEN_BUDGET)
+    return DEFAULT_TOKEN_BUDGET
+
+
+def context_window():
+    """num_ctx used for generation (ollama.num_ctx in the config, default 4096)."""
+    return int(get_llm_client().config.get("num_ctx", DEFAULT_NUM_CTX))
+
+
+def generation_options(prompt_template):
+    # Send num_ctx explicitly so the server window matches the packing budget, and cap the
+    # answer at the tokens build_prompt reserved for it so prompt + answer fit the window
+    return {"temperature": 0.0, "num_ctx": context_window(), "num_predict": token_budget(prompt_template)}
+
+
+def build_prompt(query, context_chunks, prompt_template, language):
     if language == 'zh':
-        prompt_template += "\n\nPlease answer in Simplified Chinese."
+        instruction = "\n\nPlease answer in Simplified Chinese."
     else:
-        prompt_template += "\n\nPlease answer in English."
+        instruction = "\n\nPlease answer in English."
+
+    # Context gets whatever the window leaves after the prompt skeleton and the answer
+    counter = get_token_counter(get_llm_client().config.get("tokenizer"))
+    skeleton = prompt_template.replace("{query}", query).replace("{context}", "") + instruction
+    budget = (context_window() - counter.count(skeleton)
+              - token_budget(prompt_template) - CONTEXT_SAFETY_MARGIN)
+    context = pack_context(context_chunks, max(budget, 0), language, counter)
+
+    prompt_template = prompt_template.replace("{query}", query).replace("{context}", context)
+    prompt_template += instruction
         
     # prompt = f"""You are an assistant for question-answering tasks. \
     # Use the following pieces of retrieved context to answer the question. \
     # If you don't know the answer, just say that you don't know. \
     # Use three sentences maximum and keep the answer concise.\n\nQuestion: {query} \nContext: {context} \nAnswer:\n"""
-    return llm_generate(prompt_template)
+    return prompt_template
+
+
+def generate_answer(query, context_chunks, prompt_template, language, stream=False, stop=None):
+    """
+    Generates the answer. With stream=True the answer is streamed under the
+    template's token budget (and optional stop sequences), and time-to-first-token
+    and tokens/sec are recorded on the shared LLM client.
+    """
+    prompt = build_prompt(query, context_chunks, prompt_template, language)
+    if not stream:
+        return llm_generate(prompt, options=generation_options(prompt_template))
+    try:
+        answer, _ = get_llm_client().generate_stream(prompt, options=generation_options(prompt_template), stop=stop)
+        return answer
+    except Exception as e:
+        return f"Error using Ollama Python client: {e}"
+
+
+async def generate_answer_async(query, context_chunks, prompt_template, language, stream=False, stop=None):
+    prompt = build_prompt(query, context_chunks, prompt_template, language)
+    if not stream:
+        return await llm_generate_async(prompt, options=generation_options(prompt_template))
+    try:
+        answer, _ = await get_llm_client().generate_stream_async(
+            prompt, options=generation_options(prompt_template), stop=stop
+        )
+        return answer
+    except Exception as e:
+        return f"Error using Ollama Python client: {e}"
 
 
 if __name__ == "__main__":
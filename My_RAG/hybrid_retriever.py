@@ -0,0 +1,208 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+# Standard RRF constant: dampens the influence of the very top ranks
+DEFAULT_RRF_K = 60
+# Candidates fetched from each leg per requested result
+DEFAULT_CANDIDATE_FACTOR = 2
+
+
+def chunk_key(chunk):
+    """Identifies a chunk across retrievers built from the same chunk list."""
+    metadata = chunk.get('metadata') or {}
+    if 'chunk_index' in metadata:
+        return metadata['chunk_index']
+    return chunk['page_content']
+
+
+def reciprocal_rank_fusion(result_lists, weights=None, k=DEFAULT_RRF_K):
+    """
+    Fuses ranked lists of (chunk, score) by reciprocal rank: sum(w / (k + rank)).
+
+    Returns:
+        List of (chunk, fused score), best first
+    """
+    weights = weights or [1.0] * len(result_lists)
+    fused = {}
+    chunks = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, (chunk, _) in enumerate(results, start=1):
+            key = chunk_key(chunk)
+            chunks.setdefault(key, chunk)
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [(chunks[key], fused[key]) for key in order]
+
+
+def weighted_score_fusion(result_lists, weights=None):
+    """
+    Fuses lists of (chunk, score) by a weighted sum of min-max normalized scores
+    (BM25 and cosine scores live on different scales).
+
+    Returns:
+        List of (chunk, fused score), best first
+    """
+    weights = weights or [1.0] * len(result_lists)
+    fused = {}
+    chunks = {}
+    for results, weight in zip(result_lists, weights):
+        if not results:
+            continue
+        scores = [score for _, score in results]
+        low, high = min(scores), max(scores)
+        span = high - low
+        for chunk, score in results:
+            key = chunk_key(chunk)
+            chunks.setdefault(key, chunk)
+            normalized = (score - low) / span if span > 0 else 1.0
+            fused[key] = fused.get(key, 0.0) + weight * normalized
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [(chunks[key], fused[key]) for key in order]
+
+
+class HybridRetriever:
+
+    def __init__(self, sparse, dense, fusion="rrf", weights=(1.0, 1.0), rrf_k=DEFAULT_RRF_K,
+                 candidate_factor=DEFAULT_CANDIDATE_FACTOR):
+        """
+        Initialize hybrid retriever.
+
+        Both legs are queried concurrently, so a search costs about
+        max(BM25, dense) rather than their sum.
+
+        Args:
+            sparse: PyseriniRetriever (BM25)
+            dense: DenseRetriever over the same chunks
+            fusion: 'rrf' (reciprocal rank fusion) or 'weighted' (normalized score sum)
+            weights: (sparse weight, dense weight)
+            rrf_k: RRF rank constant
+            candidate_factor: Each leg returns candidate_factor * top_k candidates
+        """
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion method: {fusion}")
+        self.sparse = sparse
+        self.dense = dense
+        self.fusion = fusion
+        self.weights = list(weights)
+        self.rrf_k = rrf_k
+        self.candidate_factor = candidate_factor
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid")
+        self._stats_lock = threading.Lock()
+        # Per-leg wall-clock seconds of the last call and running totals
+        self.last_timings = {}
+        self.stats = {}
+
+    def _fuse(self, sparse_results, dense_results):
+        if self.fusion == "rrf":
+            return reciprocal_rank_fusion([sparse_results, dense_results], self.weights, self.rrf_k)
+        return weighted_score_fusion([sparse_results, dense_results], self.weights)
+
+    @staticmethod
+    def _timed(fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        return result, time.perf_counter() - start
+
+    def _record(self, timings):
+        with self._stats_lock:
+            self.last_timings = timings
+            for leg, seconds in timings.items():
+                entry = self.stats.setdefault(leg, {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+                entry["calls"] += 1
+                entry["total_s"] += seconds
+                entry["max_s"] = max(entry["max_s"], seconds)
+
+    def cache_settings(self):
+        """Fusion settings and both legs' settings, for result caches"""
+        return {
+            'retriever': 'hybrid',
+            'fusion': self.fusion,
+            'weights': self.weights,
+            'rrf_k': self.rrf_k,
+            'candidate_factor': self.candidate_factor,
+            'sparse': self.sparse.cache_settings(),
+            'dense': self.dense.cache_settings(),
+        }
+
+    def retrieve(self, query, top_k=5, allowed_ids=None):
+        """
+        Retrieve top-k chunks by fusing the BM25 and dense rankings.
+
+        Args:
+            query: Query string
+            top_k: Number of top results to return
+            allowed_ids: Optional chunk positions to search instead of all chunks
+
+        Returns:
+            List of top-k chunks
+        """
+        return [chunk for chunk, _ in self.retrieve_with_scores(query, top_k, allowed_ids=allowed_ids)]
+
+    def retrieve_with_scores(self, query, top_k=5, allowed_ids=None):
+        """
+        Retrieve top-k chunks with their fused scores.
+
+        Returns:
+            List of tuples (chunk, fused score)
+        """
+        return self.retrieve_batch([query], top_k=top_k, with_scores=True,
+                                   allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        """
+        Runs both legs' batch search concurrently and fuses per query.
+
+        Args:
+            queries: List of query strings
+            top_k: Number of results per query
+            threads: Search threads for the BM25 leg
+            with_scores: Return (chunk, fused score) tuples instead of chunks
+            allowed_ids: Optional per-query chunk positions, passed to both legs
+
+        Returns:
+            List of result lists, in the same order as queries
+        """
+        if not queries:
+            return []
+        start = time.perf_counter()
+        depth = top_k * self.candidate_factor
+        sparse_future = self._executor.submit(self._timed, self.sparse.retrieve_batch, queries, top_k=depth,
+                                              threads=threads, with_scores=True, allowed_ids=allowed_ids)
+        dense_future = self._executor.submit(self._timed, self.dense.retrieve_batch, queries, top_k=depth,
+                                             with_scores=True, allowed_ids=allowed_ids)
+        sparse_batch, sparse_s = sparse_future.result()
+        dense_batch, dense_s = dense_future.result()
+
+        fusion_start = time.perf_counter()
+        all_results = []
+        for sparse_results, dense_results in zip(sparse_batch, dense_batch):
+            fused = self._fuse(sparse_results, dense_results)[:top_k]
+            all_results.append(fused if with_scores else [chunk for chunk, _ in fused])
+        end = time.perf_counter()
+        self._record({"bm25": sparse_s, "dense": dense_s, "fusion": end - fusion_start, "total": end - start})
+        return all_results
+
+    def timing_summary(self) -> str:
+        with self._stats_lock:
+            lines = [f"  {leg:<8} calls={entry['calls']:<5} total={entry['total_s']:.2f}s "
+                     f"mean={entry['total_s'] / entry['calls'] * 1000:.1f}ms max={entry['max_s'] * 1000:.1f}ms"
+                     for leg, entry in self.stats.items()]
+        return "Hybrid retrieval timings:\n" + "\n".join(lines) if lines else "Hybrid retrieval timings: no calls"
+
+
+def create_hybrid_retriever(sparse, dense, fusion="rrf", weights=(1.0, 1.0)):
+    """
+    Creates a hybrid retriever from a BM25 and a dense retriever over the same chunks.
+
+    Args:
+        sparse: PyseriniRetriever
+        dense: DenseRetriever
+        fusion: 'rrf' or 'weighted'
+        weights: (sparse weight, dense weight)
+
+    Returns:
+        HybridRetriever instance
+    """
+    return HybridRetriever(sparse, dense, fusion=fusion, weights=weights)
@@ -0,0 +1,126 @@
+"""
+Incremental corpus updates.
+
+A manifest records, per doc_id, the content hash of the document and the ids
+of the chunks it produced. Diffing a new corpus against the manifest tells
+which documents were added, changed or removed, so only those documents are
+re-chunked and only their chunks are deleted from / added to an index.
+
+Manifest layout:
+    {"docs": {"<doc_id>": {"hash": "<sha256>", "chunk_ids": [int, ...]}},
+     "next_chunk_id": int}
+Chunk ids are never reused, so ids held by a retriever stay valid.
+"""
+from dataclasses import dataclass, field
+import hashlib
+import json
+
+from chunker import iter_chunk_spans, make_chunk
+
+
+MANIFEST_FILE = "corpus_manifest.json"
+
+
+def document_hash(doc) -> str:
+    """Content hash of a document (text and metadata)."""
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+@dataclass
+class CorpusDiff:
+    added: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    unchanged: int = 0
+
+    @property
+    def is_empty(self):
+        return not (self.added or self.changed or self.removed)
+
+    def __str__(self):
+        return (f"{len(self.added)} added, {len(self.changed)} changed, "
+                f"{len(self.removed)} removed, {self.unchanged} unchanged")
+
+
+def build_manifest(chunk_doc_ids, doc_hashes=None) -> dict:
+    """
+    Builds a manifest for chunks whose ids are their positions.
+
+    Args:
+        chunk_doc_ids: doc_id of every chunk, in chunk order
+        doc_hashes: Optional {doc_id (str): hash}. Documents without a known hash
+            are treated as changed on the first update.
+    """
+    doc_hashes = doc_hashes or {}
+    docs = {}
+    num_chunks = 0
+    for chunk_id, doc_id in enumerate(chunk_doc_ids):
+        doc_id = str(doc_id)
+        entry = docs.setdefault(doc_id, {'hash': doc_hashes.get(doc_id), 'chunk_ids': []})
+        entry['chunk_ids'].append(chunk_id)
+        num_chunks += 1
+    return {'docs': docs, 'next_chunk_id': num_chunks}
+
+
+def corpus_hash(manifest) -> str:
+    """Hash over the document hashes of a manifest (identifies the indexed corpus)."""
+    h = hashlib.sha256()
+    for doc_id in sorted(manifest['docs']):
+        h.update(f"{doc_id}:{manifest['docs'][doc_id].get('hash')}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def diff_documents(manifest, docs) -> CorpusDiff:
+    """Compares docs (already filtered to one language) against the manifest by doc_id and content hash."""
+    diff = CorpusDiff()
+    known = manifest['docs']
+    seen = set()
+    for doc in docs:
+        doc_id = str(doc.get('doc_id'))
+        seen.add(doc_id)
+        entry = known.get(doc_id)
+        if entry is None:
+            diff.added.append(doc)
+        elif entry.get('hash') != document_hash(doc):
+            diff.changed.append(doc)
+        else:
+            diff.unchanged += 1
+    diff.removed = [doc_id for doc_id in known if doc_id not in seen]
+    return diff
+
+
+def apply_diff(manifest, diff, language, chunk_size, chunk_overlap):
+    """
+    Re-chunks the added/changed documents and updates the manifest in place.
+
+    Returns:
+        (deleted_chunk_ids, new_chunks) where new_chunks is a list of
+        (chunk_id, chunk) and each chunk's metadata.chunk_index is its id
+    """
+    deleted = []
+    for doc_id in diff.removed:
+        deleted.extend(manifest['docs'].pop(doc_id)['chunk_ids'])
+    for doc in diff.changed:
+        deleted.extend(manifest['docs'].pop(str(doc.get('doc_id')))['chunk_ids'])
+
+    new_chunks = []
+    for doc in diff.added + diff.changed:
+        text = doc['content']
+        chunk_ids = []
+        for start, end in iter_chunk_spans(text, language, chunk_size, chunk_overlap):
+            chunk_id = manifest['next_chunk_id']
+            manifest['next_chunk_id'] += 1
+            new_chunks.append((chunk_id, make_chunk(doc, text, start, end, chunk_id)))
+            chunk_ids.append(chunk_id)
+        manifest['docs'][str(doc.get('doc_id'))] = {'hash': document_hash(doc), 'chunk_ids': chunk_ids}
+    return deleted, new_chunks
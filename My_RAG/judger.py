@@ -8,7 +8,7 @@ def enhanced_prompt(query, context_chunks, prompt):
     context = "\n\n".join([chunk['page_content'] for chunk in context_chunks])
     prompt = f"""
     """
-    return llm_generate(prompt)
+    return llm_generate(prompt, tag="judge")
 
 
 # test the function
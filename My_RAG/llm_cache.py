@@ -0,0 +1,132 @@
+"""
+Persistent cache for deterministic LLM responses.
+
+Responses are stored in a small SQLite database keyed by a hash of
+(model, prompt, options). The cache is bounded by entry count and evicts
+the least recently used entries first. The entry count is kept in memory and
+hits only record their access time, which is written in batches (and before
+any eviction or on close), so a hit costs a single SELECT.
+"""
+from pathlib import Path
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent / "llm_cache" / "responses.sqlite"
+DEFAULT_MAX_ENTRIES = 100_000
+# Cache hits whose last_access update is held in memory before it is written
+ACCESS_FLUSH_BATCH = 256
+
+
+def make_cache_key(model: str, prompt: str, options: dict = None, **extra) -> str:
+    """Stable key for a generate request."""
+    payload = {"model": model, "prompt": prompt, "options": options or {}, **extra}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite file holding the cache
+            max_entries: Maximum number of cached responses before LRU eviction
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Shared across threads (the async pipeline and thread pools); guarded by _lock
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        # key -> last access time of hits not yet written to the database
+        self._accessed = {}
+
+    def get(self, key: str):
+        """Returns the cached response or None, refreshing its LRU position on a hit."""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_FLUSH_BATCH:
+                self._flush_accessed()
+                self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            now = time.time()
+            self._accessed.pop(key, None)
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO responses (key, response, last_access) VALUES (?, ?, ?)",
+                (key, response, now)
+            ).rowcount
+            if inserted:
+                self._count += 1
+            else:
+                self._conn.execute("UPDATE responses SET response = ?, last_access = ? WHERE key = ?",
+                                   (response, now, key))
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _flush_accessed(self):
+        """Writes the pending last_access updates (the caller commits)."""
+        if self._accessed:
+            self._conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                   [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def _evict(self):
+        # Pending hits first, so recently read entries are not taken for the oldest
+        self._flush_accessed()
+        deleted = self._conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+            (self._count - self.max_entries,)
+        ).rowcount
+        self._count -= deleted
+
+    def flush(self):
+        """Writes the access times of recent hits to the database."""
+        with self._lock:
+            self._flush_accessed()
+            self._conn.commit()
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._accessed.clear()
+            self._count = 0
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return f"LLM cache: hits={self.hits} misses={self.misses} hit_rate={hit_rate:.1%} entries={len(self)}"
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._conn.commit()
+            self._conn.close()
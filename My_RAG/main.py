@@ -1,49 +1,200 @@
-from utils import load_jsonl, save_jsonl, expand_query, rerank_chunks
-from chunker import chunk_documents 
-from pyserini_retriever import create_retriever
-from generator import generate_answer
-from selector import select_prompt
+from utils import load_jsonl, iter_jsonl, file_sha256, save_jsonl, expand_query, expand_query_async, rerank_chunks, get_llm_client
+from chunker import chunk_documents, iter_chunks, semantic_chunk_documents, CHUNKER_VERSION
+from pyserini_retriever import create_incremental_retriever, create_retriever
+from dense_retriever import create_dense_retriever
+from hybrid_retriever import create_hybrid_retriever
+from entity_index import create_entity_filtered_retriever
+from query_cache import create_cached_retriever
+from passage_merger import merge_passages
+from generator import generate_answer, generate_answer_async
+from selector import select_prompt, select_prompt_async, load_templates
+from query_analysis import analyze_query, analyze_query_async
 from judger import enhanced_prompt
-import argparse, tqdm
+import argparse, asyncio, tqdm
 
 
-def main(query_path, docs_path, language, output_path):
+async def process_queries_async(queries, retriever, language, concurrency, llm_router=False, query_analysis=False,
+                                stream=False, top_k=30, passage_merging=False, max_passage_chars=None,
+                                entity_filter=False):
+    """
+    Runs expand -> retrieve -> select -> generate for every query, keeping up to
+    `concurrency` queries in flight. Results are written back into each query
+    dict, so the output order matches the input order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm.tqdm(total=len(queries), desc=f"Processing Queries (async x{concurrency})")
+
+    async def process(query):
+        async with semaphore:
+            query_text = query['query']['content']
+            if query_analysis:
+                # One structured call yields both the expansion and the template
+                analysis = await analyze_query_async(query_text, language)
+                full_query = f"{query_text} {analysis['keywords']}"
+            else:
+                expanded_query = await expand_query_async(query_text, language)
+                full_query = f"{query_text} {expanded_query}"
+            # Entities are matched on the user's query, never on names the expansion made up
+            allowed_ids = retriever.allowlists([query_text]) if entity_filter else None
+            # Dense and hybrid retrieval call the embedding endpoint; keep them off the event loop
+            retrieved_chunks = (await asyncio.to_thread(retriever.retrieve_batch, [full_query], top_k=top_k,
+                                                        allowed_ids=allowed_ids))[0]
+            if passage_merging:
+                retrieved_chunks = merge_passages(retrieved_chunks, max_passage_chars)
+            if query_analysis:
+                prompt_template = load_templates()[analysis['template']]
+            else:
+                prompt_template = await select_prompt_async(query_text, retrieved_chunks, llm_fallback=llm_router)
+            answer = await generate_answer_async(query_text, retrieved_chunks, prompt_template, language, stream=stream)
+
+            query["prediction"]["content"] = answer
+            query["prediction"]["references"] = [chunk['page_content'] for chunk in retrieved_chunks[:2]]
+        progress.update(1)
+
+    await asyncio.gather(*(process(query) for query in queries))
+    progress.close()
+
+
+def main(query_path, docs_path, language, output_path, index_threads=None, search_threads=None, concurrency=1,
+         use_llm_cache=True, llm_router=False, query_analysis=False, stream=False, stream_docs=False,
+         compact_chunks=False, chunk_workers=1, incremental=False, semantic_chunks=False,
+         retriever_type="pyserini", ann=None, nprobe=8, fusion="rrf", top_k=30,
+         entity_filter=False, entity_top_k=None, retrieval_cache=False, cache_ttl=3600, rm3="always",
+         feedback_log=None, passage_merging=False, max_passage_chars=None):
+    if retriever_type != "pyserini" and (incremental or stream_docs):
+        raise ValueError(f"--retriever {retriever_type} needs in-memory chunks; "
+                         "--incremental and --stream_docs only build a Pyserini index")
+    get_llm_client().use_cache = use_llm_cache
+
+    # Modified: Increased chunk size to 300 to capture more context
+    chunk_params = {"chunk_size": 500, "chunk_overlap": 100}
+
     # 1. Load Data
-    print("Loading documents...")
-    docs_for_chunking = load_jsonl(docs_path)
     queries = load_jsonl(query_path)
-    print(f"Loaded {len(docs_for_chunking)} documents.")
     print(f"Loaded {len(queries)} queries.")
 
-    # 2. Chunk Documents
-    print("Chunking documents...")
-    """
-    # Semantic Chunking
-    from chunker import semantic_chunk_documents
-    chunks = semantic_chunk_documents(docs_for_chunking, language, max_chunk_size=500, similarity_threshold=0.4)
-    """
-    # Modified: Increased chunk size to 300 to capture more context
-    chunks = chunk_documents(docs_for_chunking, language, chunk_size=500, chunk_overlap=100)
-    print(f"Created {len(chunks)} chunks.")
+    if incremental:
+        # 2. Keep one live index per language/config and only re-index documents
+        # that were added, changed or removed since the last run
+        print("Syncing the live index with the documents...")
+        docs = iter_jsonl(docs_path, language=language)
+        retriever = create_incremental_retriever(docs, language, chunk_params, index_threads=index_threads, rm3=rm3)
+        sparse_retriever = retriever
+    elif stream_docs:
+        # 2. Stream documents -> chunks -> indexer; nothing is held in memory and
+        # a cached index (keyed by the docs file hash) skips reading the corpus entirely
+        print("Streaming documents into the retriever...")
+        docs = iter_jsonl(docs_path, language=language)
+        chunks = iter_chunks(docs, language, **chunk_params)
+        source_fingerprint = f"{file_sha256(docs_path)}:chunker-v{CHUNKER_VERSION}"
+        retriever = create_retriever(chunks, language, chunk_params=chunk_params, index_threads=index_threads,
+                                     source_fingerprint=source_fingerprint, rm3=rm3)
+        sparse_retriever = retriever
+    else:
+        print("Loading documents...")
+        docs_for_chunking = load_jsonl(docs_path)
+        print(f"Loaded {len(docs_for_chunking)} documents.")
+
+        # 2. Chunk Documents
+        print("Chunking documents...")
+        if semantic_chunks:
+            chunk_params = {"semantic": True, "max_chunk_size": 500, "similarity_threshold": 0.4}
+            chunks = semantic_chunk_documents(docs_for_chunking, language, max_chunk_size=500,
+                                              similarity_threshold=0.4, compact=compact_chunks)
+        else:
+            chunks = chunk_documents(docs_for_chunking, language, compact=compact_chunks, workers=chunk_workers,
+                                     **chunk_params)
+        print(f"Created {len(chunks)} chunks.")
 
-    # 3. Create Retriever
-    print("Creating retriever...")
-    retriever = create_retriever(chunks, language)
+        # 3. Create Retriever (index is cached under ./index_cache, keyed by chunks + settings)
+        print("Creating retriever...")
+        sparse_retriever = None
+        if retriever_type in ("pyserini", "hybrid"):
+            sparse_retriever = create_retriever(chunks, language, chunk_params=chunk_params,
+                                                index_threads=index_threads, rm3=rm3)
+        if retriever_type == "dense":
+            retriever = create_dense_retriever(chunks, language, chunk_params=chunk_params, ann=ann,
+                                               nprobe=nprobe)
+        elif retriever_type == "hybrid":
+            retriever = create_hybrid_retriever(
+                sparse_retriever,
+                create_dense_retriever(chunks, language, chunk_params=chunk_params, ann=ann, nprobe=nprobe),
+                fusion=fusion
+            )
+        else:
+            retriever = sparse_retriever
+        if entity_filter:
+            # Queries naming a company / court / patient only search that entity's chunks
+            retriever = create_entity_filtered_retriever(retriever, chunks, filtered_top_k=entity_top_k)
+    if entity_filter and (incremental or stream_docs):
+        print("Entity filter needs the chunks in memory; searching without it.")
+        entity_filter = False
+    if retrieval_cache:
+        # Repeated queries (up to case, whitespace and punctuation) skip the search
+        retriever = create_cached_retriever(retriever, ttl=cache_ttl)
     print("Retriever created successfully.")
 
+    def print_summaries():
+        print(get_llm_client().timing_summary())
+        get_llm_client().close_caches()
+        if hasattr(retriever, "timing_summary"):
+            print(retriever.timing_summary())
+        if entity_filter:
+            print(retriever.filter_summary())
+        if retrieval_cache:
+            print(retriever.cache_summary())
+        if sparse_retriever is not None and rm3 == "adaptive":
+            print(sparse_retriever.feedback_summary())
+            if feedback_log:
+                sparse_retriever.save_feedback_log(feedback_log)
+                print(f"RM3 decisions saved at '{feedback_log}'")
+
+    if concurrency > 1:
+        asyncio.run(process_queries_async(queries, retriever, language, concurrency,
+                                          llm_router=llm_router, query_analysis=query_analysis, stream=stream,
+                                          top_k=top_k, passage_merging=passage_merging,
+                                          max_passage_chars=max_passage_chars, entity_filter=entity_filter))
+        save_jsonl(output_path, queries)
+        print("Predictions saved at '{}'".format(output_path))
+        print_summaries()
+        return
 
-    for query in tqdm.tqdm(queries, desc="Processing Queries"):
-        # 4. Retrieve relevant chunks
+    # 4. Expand queries
+    full_queries = []
+    analyses = []
+    for query in tqdm.tqdm(queries, desc="Expanding Queries"):
         query_text = query['query']['content']
         
+        if query_analysis:
+            # Expansion, template choice and entities from a single structured call
+            analysis = analyze_query(query_text, language)
+            analyses.append(analysis)
+            full_queries.append(f"{query_text} {analysis['keywords']}")
+            continue
+
         # 🌟(optional) Query Expansion
         expanded_query = expand_query(query_text, language)
-        full_query = f"{query_text} {expanded_query}"
-        
-        """
-        Use retriever(bm25, ...) to get Top-30 candidates
-        """
-        retrieved_chunks = retriever.retrieve(full_query, top_k=30)
+        full_queries.append(f"{query_text} {expanded_query}")
+
+    """
+    Use retriever(bm25, ...) to get Top-k (default 30) candidates for all queries in one batch
+    """
+    print("Retrieving chunks...")
+    # Entities are matched on the user's query, never on names the expansion made up
+    allowed_ids = retriever.allowlists([query['query']['content'] for query in queries]) if entity_filter else None
+    all_retrieved_chunks = retriever.retrieve_batch(full_queries, top_k=top_k, threads=search_threads,
+                                                    allowed_ids=allowed_ids)
+    if passage_merging:
+        # Stitch overlapping neighbours of the same document so the prompt holds each sentence once
+        num_chunks = sum(len(chunks) for chunks in all_retrieved_chunks)
+        chars_before = sum(len(chunk['page_content']) for chunks in all_retrieved_chunks for chunk in chunks)
+        all_retrieved_chunks = [merge_passages(chunks, max_passage_chars) for chunks in all_retrieved_chunks]
+        chars_after = sum(len(chunk['page_content']) for chunks in all_retrieved_chunks for chunk in chunks)
+        print(f"Merged {num_chunks} chunks into {sum(len(chunks) for chunks in all_retrieved_chunks)} passages "
+              f"({chars_before} -> {chars_after} chars)")
+
+    for i, (query, retrieved_chunks) in enumerate(tqdm.tqdm(zip(queries, all_retrieved_chunks), total=len(queries), desc="Processing Queries")):
+        query_text = query['query']['content']
         
         """
         Use llm to Rerank to get Top-5
@@ -57,15 +208,19 @@ def main(query_path, docs_path, language, output_path):
         # Select prompt template 
         # (optional) enhance prompt        
         # Generate Answer
-        prompt_template = select_prompt(query_text, retrieved_chunks) 
+        if query_analysis:
+            prompt_template = load_templates()[analyses[i]['template']]
+        else:
+            prompt_template = select_prompt(query_text, retrieved_chunks, llm_fallback=llm_router)
         # final_prompt = enhanced_prompt(query_text, retrieved_chunks, prompt_template)
-        answer = generate_answer(query_text, retrieved_chunks, prompt_template, language)
+        answer = generate_answer(query_text, retrieved_chunks, prompt_template, language, stream=stream)
 
         query["prediction"]["content"] = answer
         query["prediction"]["references"] = [chunk['page_content'] for chunk in retrieved_chunks[:2]]
 
     save_jsonl(output_path, queries)
     print("Predictions saved at '{}'".format(output_path))
+    print_summaries()
 
 
 if __name__ == "__main__":
@@ -74,5 +229,42 @@ if __name__ == "__main__":
     parser.add_argument('--docs_path', help='Path to the documents file')
     parser.add_argument('--language', help='Language to filter queries (zh or en), if not specified, process all')
     parser.add_argument('--output', help='Path to the output file')
+    parser.add_argument('--index_threads', type=int, default=None, help='Lucene indexing threads (default: CPU count)')
+    parser.add_argument('--search_threads', type=int, default=None, help='Batch retrieval threads (default: CPU count)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Queries kept in flight against Ollama (>1 enables the async pipeline)')
+    parser.add_argument('--no_llm_cache', action='store_true', help='Bypass the persistent LLM response cache')
+    parser.add_argument('--llm_router', action='store_true', help='Ask the LLM router when the local template classifier is not confident')
+    parser.add_argument('--query_analysis', action='store_true', help='Expand the query and pick its template in one structured LLM call')
+    parser.add_argument('--stream', action='store_true', help='Stream answers under per-template token budgets and report TTFT / tokens per sec')
+    parser.add_argument('--stream_docs', action='store_true', help='Stream documents and chunks into the index instead of loading them into memory')
+    parser.add_argument('--compact_chunks', action='store_true', help='Keep chunks as spans in a ChunkStore instead of per-chunk dicts')
+    parser.add_argument('--chunk_workers', type=int, default=1, help='Processes used for chunking (output is identical to serial)')
+    parser.add_argument('--semantic_chunks', action='store_true', help='Cut chunks where adjacent sentences stop being similar (embeds every sentence, cached)')
+    parser.add_argument('--retriever', choices=['pyserini', 'dense', 'hybrid'], default='pyserini', help='BM25 (Pyserini), dense embedding or fused BM25 + dense retrieval (dense/hybrid: in-memory chunks only)')
+    parser.add_argument('--fusion', choices=['rrf', 'weighted'], default='rrf', help='How --retriever hybrid fuses the BM25 and dense rankings')
+    parser.add_argument('--top_k', type=int, default=30, help='Chunks retrieved per query')
+    parser.add_argument('--ann', choices=['ivf'], default=None, help='Approximate nearest-neighbour index for --retriever dense')
+    parser.add_argument('--nprobe', type=int, default=8, help='IVF lists scanned per query (recall vs latency)')
+    parser.add_argument('--incremental', action='store_true', help='Update a live index in place, re-indexing only added/changed/removed documents')
+    parser.add_argument('--entity_filter', action='store_true', help='Restrict queries that name a company / court / patient to that entity\'s chunks')
+    parser.add_argument('--retrieval_cache', action='store_true', help='Cache retrieval results per normalized query, top_k and index version')
+    parser.add_argument('--cache_ttl', type=float, default=3600, help='Seconds a cached retrieval result stays valid')
+    parser.add_argument('--rm3', choices=['always', 'adaptive', 'off'], default='always', help='RM3 feedback for BM25: every query, only after a weak plain first pass, or never')
+    parser.add_argument('--feedback_log', default=None, help='Save the per-query adaptive RM3 decisions and timings as JSONL')
+    parser.add_argument('--merge_passages', action='store_true', help='Merge overlapping retrieved chunks of a document into contiguous passages before prompting')
+    parser.add_argument('--max_passage_chars', type=int, default=None, help='Longest merged passage (default: unbounded)')
+    parser.add_argument('--entity_top_k', type=int, default=None, help='Chunks retrieved for entity-filtered queries (default: --top_k)')
     args = parser.parse_args()
-    main(args.query_path, args.docs_path, args.language, args.output)
+    if args.retriever != 'pyserini' and (args.incremental or args.stream_docs):
+        parser.error(f"--retriever {args.retriever} cannot be combined with --incremental or --stream_docs")
+    main(args.query_path, args.docs_path, args.language, args.output,
+         index_threads=args.index_threads, search_threads=args.search_threads, concurrency=args.concurrency,
+         use_llm_cache=not args.no_llm_cache, llm_router=args.llm_router, query_analysis=args.query_analysis,
+         stream=args.stream, stream_docs=args.stream_docs,
+         compact_chunks=args.compact_chunks, chunk_workers=args.chunk_workers, incremental=args.incremental,
+         semantic_chunks=args.semantic_chunks, retriever_type=args.retriever,
+         ann=args.ann, nprobe=args.nprobe, fusion=args.fusion, top_k=args.top_k,
+         entity_filter=args.entity_filter, entity_top_k=args.entity_top_k,
+         retrieval_cache=args.retrieval_cache, cache_ttl=args.cache_ttl, rm3=args.rm3,
+         feedback_log=args.feedback_log, passage_merging=args.merge_passages,
+         max_passage_chars=args.max_passage_chars)
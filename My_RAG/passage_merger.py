@@ -0,0 +1,117 @@
+"""
+Post-retrieval merging of overlapping chunks into contiguous passages.
+
+Chunks of one document overlap by chunk_overlap characters, so a top-k list
+often holds neighbours that repeat the same sentences. Hits are grouped by
+document and windows that overlap or touch (by their start/end offsets) are
+stitched into one passage, so the context budget holds each sentence once.
+English chunks end and start on sentences, so consecutive chunks that do not
+overlap are apart by the whitespace between two sentences; they touch too.
+"""
+
+
+def _span(chunk):
+    metadata = chunk.get('metadata') or {}
+    doc_id = metadata.get('doc_id')
+    start = metadata.get('start_index')
+    end = metadata.get('end_index')
+    if doc_id is None or start is None or end is None:
+        return None
+    return doc_id, start, end
+
+
+def _overlap(text, member_text, limit):
+    """Length of the longest prefix of member_text (at most limit chars) that text ends with."""
+    for length in range(min(limit, len(member_text)), 0, -1):
+        if text.endswith(member_text[:length]):
+            return length
+    return 0
+
+
+def _chunk_index(chunk):
+    return (chunk.get('metadata') or {}).get('chunk_index')
+
+
+def _merged_chunk(members):
+    """One chunk covering members (same document, sorted by start, overlapping or touching)."""
+    first = members[0]['chunk']
+    if len(members) == 1:
+        return first
+    text = first['page_content']
+    _, start, end = _span(first)
+    for member in members[1:]:
+        _, member_start, member_end = _span(member['chunk'])
+        if member_end > end:
+            # Skip the characters the passage already holds. English chunk texts drop the
+            # whitespace between sentences, so the overlap is matched on text, not offsets.
+            member_text = member['chunk']['page_content']
+            text += member_text[_overlap(text, member_text, end - member_start):]
+            end = member_end
+    best = min(members, key=lambda member: member['rank'])['chunk']
+    metadata = dict(best['metadata'])
+    metadata['start_index'] = start
+    metadata['end_index'] = end
+    metadata['merged_chunks'] = [member['chunk']['metadata'].get('chunk_index') for member in members]
+    return {'page_content': text, 'metadata': metadata}
+
+
+def merge_passages(results, max_passage_chars=None):
+    """
+    Merges overlapping or adjacent hits of the same document into single passages.
+
+    Chunks without doc_id / start_index / end_index metadata are kept as they are.
+
+    Args:
+        results: Retrieved chunks, or (chunk, score) tuples, best first
+        max_passage_chars: Optional cap on a merged passage's length; a window
+            that would grow it past the cap starts a new passage instead
+
+    Returns:
+        Passages in the same form as results, ordered by their best member's
+        rank. A merged passage keeps the best score of its members.
+    """
+    if not results:
+        return []
+    with_scores = isinstance(results[0], tuple)
+    hits = [{'chunk': item[0] if with_scores else item, 'score': item[1] if with_scores else None, 'rank': rank}
+            for rank, item in enumerate(results)]
+
+    by_doc = {}
+    passages = []
+    for hit in hits:
+        span = _span(hit['chunk'])
+        if span is None:
+            passages.append([hit])
+        else:
+            by_doc.setdefault(span[0], []).append(hit)
+
+    for doc_hits in by_doc.values():
+        doc_hits.sort(key=lambda hit: _span(hit['chunk'])[1:])
+        group = [doc_hits[0]]
+        _, group_start, group_end = _span(doc_hits[0]['chunk'])
+        # chunk_index of the chunk ending the group; the next chunk of the document touches it
+        group_last = _chunk_index(doc_hits[0]['chunk'])
+        for hit in doc_hits[1:]:
+            _, start, end = _span(hit['chunk'])
+            chunk_index = _chunk_index(hit['chunk'])
+            touches = start <= group_end or (group_last is not None and chunk_index == group_last + 1)
+            too_long = max_passage_chars is not None and max(end, group_end) - group_start > max_passage_chars
+            if touches and not too_long:
+                group.append(hit)
+                if end > group_end:
+                    group_end, group_last = end, chunk_index
+                continue
+            passages.append(group)
+            group = [hit]
+            group_start, group_end, group_last = start, end, chunk_index
+        passages.append(group)
+
+    passages.sort(key=lambda members: min(member['rank'] for member in members))
+    merged = []
+    for members in passages:
+        chunk = _merged_chunk(members)
+        if with_scores:
+            merged.append((chunk, max(member['score'] for member in members)))
+        else:
+            merged.append(chunk)
+    return merged
@@ -1,189 +1,614 @@
 from pyserini.search.lucene import LuceneSearcher
+from chunker import chunk_documents, is_chunkable
+from incremental import (MANIFEST_FILE, apply_diff, build_manifest, corpus_hash, diff_documents,
+                         document_hash, load_manifest, save_manifest)
+import hashlib
 import json
 import os
 import tempfile
 import shutil
+import time
+from collections.abc import Sequence
+from functools import lru_cache
 from pathlib import Path
 
 
+# Default location of the content-addressed index cache (one sub-directory per fingerprint)
+DEFAULT_INDEX_CACHE = Path(__file__).parent.parent / "index_cache"
+# Written last into a finished index; its fingerprint decides whether the index can be reused
+INDEX_META_FILE = "index_meta.json"
+# Bump when the indexing layout changes so older caches are not reused
+INDEX_FORMAT_VERSION = 2
+# Chunks handed to the Lucene indexer per call
+DEFAULT_INDEX_BATCH_SIZE = 10000
+# RM3 pseudo-relevance feedback: 'always', 'adaptive' (only after a weak first pass) or 'off'
+RM3_MODES = ("always", "adaptive", "off")
+RM3_FB_TERMS = 10
+RM3_FB_DOCS = 10
+RM3_ORIGINAL_QUERY_WEIGHT = 0.5
+# Adaptive mode: a first pass whose fb_docs-th score is within this fraction of the
+# best score has no clear head, so it is re-run with RM3
+DEFAULT_RM3_MIN_MARGIN = 0.2
+
+
+def indexer_args_for(language):
+    """Indexer options that shape the index (paths excluded)"""
+    indexer_args = [
+        '-generator', 'DefaultLuceneDocumentGenerator',
+        '-storePositions',
+        '-storeDocvectors',
+        '-storeRaw'
+    ]
+    
+    # Add language-specific settings
+    if language == 'zh':
+        indexer_args.extend(['-language', 'zh'])
+    return indexer_args
+
+
+def first_pass_margin(scores, fb_docs=RM3_FB_DOCS):
+    """Relative drop from the best score to the fb_docs-th: (s1 - s_k) / s1, or None with fewer hits"""
+    if len(scores) < fb_docs or scores[0] <= 0:
+        return None
+    return (scores[0] - scores[fb_docs - 1]) / scores[0]
+
+
+def is_weak_first_pass(scores, fb_docs=RM3_FB_DOCS, min_margin=DEFAULT_RM3_MIN_MARGIN):
+    """
+    Decides whether a plain BM25 ranking is worth expanding with RM3.
+    
+    Returns:
+        (weak, margin): weak when there are fewer than fb_docs hits or the
+        scores are flat (margin below min_margin)
+    """
+    margin = first_pass_margin(scores, fb_docs)
+    return margin is None or margin < min_margin, margin
+
+
+def config_header(language, chunk_params):
+    """Everything except the chunks themselves that determines index contents"""
+    return {
+        'format': INDEX_FORMAT_VERSION,
+        'language': language,
+        'chunk_params': chunk_params or {},
+        'indexer_args': indexer_args_for(language),
+    }
+
+
 class PyseriniRetriever:
     
-    def __init__(self, chunks, language="en", index_dir=None, keep_index=True):
+    def __init__(self, chunks, language="en", index_dir=None, keep_index=True,
+                 chunk_params=None, cache_dir=None, use_cache=True, index_threads=None,
+                 index_batch_size=DEFAULT_INDEX_BATCH_SIZE, source_fingerprint=None, doc_hashes=None,
+                 rm3="always", rm3_min_margin=DEFAULT_RM3_MIN_MARGIN):
         """
         Initialize Pyserini retriever.
         
         Args:
-            chunks: List of document chunks with 'page_content' field
+            chunks: List (or ChunkStore) of document chunks with 'page_content' field, or any iterable
+                    (e.g. a generator) of them. Iterables are streamed into the indexer
+                    and never held in memory; hits are then materialized from the index.
+                    None opens the existing index at index_dir as is (e.g. to update it).
             language: Language code ('en' or 'zh')
-            index_dir: Optional path to save/load index. If None, uses temp directory
+            index_dir: Optional path to save/load index. If None, the index cache is used
             keep_index: Whether to keep index after retriever is destroyed
+            chunk_params: Chunking parameters (e.g. chunk_size, chunk_overlap), part of the cache key
+            cache_dir: Root of the index cache. Defaults to DEFAULT_INDEX_CACHE
+            use_cache: If False and no index_dir is given, build into a temp directory
+            index_threads: Lucene indexing threads. Defaults to the number of CPU cores
+            index_batch_size: Number of chunks passed to the indexer per batch
+            source_fingerprint: Hash identifying the chunk source (e.g. the docs file).
+                    Used as the cache key instead of hashing chunk texts; required for
+                    streamed chunks so a cached index can be found without consuming them.
+            doc_hashes: Optional {doc_id: content hash} recorded in the corpus manifest,
+                    so later update_documents calls can skip unchanged documents.
+            rm3: RM3 feedback mode. 'always' expands every query, 'off' never does and
+                    'adaptive' runs plain BM25 first and re-runs with RM3 only when
+                    the first-pass scores look weak (see is_weak_first_pass)
+            rm3_min_margin: Score margin below which an adaptive first pass counts as weak
         """
-        self.chunks = chunks
+        if rm3 not in RM3_MODES:
+            raise ValueError(f"Unknown RM3 mode: {rm3}")
+        self.rm3 = rm3
+        self.rm3_min_margin = rm3_min_margin
+        # Per-query adaptive RM3 decisions and timings
+        self.feedback_log = []
+        self.doc_hashes = doc_hashes
+        if chunks is None:
+            if index_dir is None:
+                raise ValueError("Opening an existing index requires index_dir.")
+            self.chunks = None
+            self._chunk_stream = None
+        elif isinstance(chunks, Sequence):
+            self.chunks = chunks
+            self._chunk_stream = None
+        else:
+            if source_fingerprint is None:
+                raise ValueError("Streamed chunks require a source_fingerprint for the index cache.")
+            self.chunks = None
+            self._chunk_stream = chunks
+        self.source_fingerprint = source_fingerprint
         self.language = language
         self.keep_index = keep_index
+        self.chunk_params = chunk_params or {}
+        self.index_threads = index_threads or os.cpu_count() or 1
+        self.index_batch_size = index_batch_size
+        # Java classes and analyzer for filtered queries, loaded on first use
+        self._query_classes = None
+        self.fingerprint = self._compute_fingerprint() if (chunks is not None) else None
         
         # Set up index directory
         if index_dir:
-            self.index_dir = index_dir
-            os.makedirs(self.index_dir, exist_ok=True)
+            self.index_dir = str(index_dir)
+        elif use_cache:
+            cache_root = Path(cache_dir) if cache_dir else DEFAULT_INDEX_CACHE
+            self.index_dir = str(cache_root / f"{language}_{self.fingerprint[:16]}")
         else:
             self.index_dir = tempfile.mkdtemp(prefix="pyserini_index_")
         
         print(f"Index directory: {self.index_dir}")
         
-        # Build index if not exists
+        # Build index if not exists (or if it was built from different chunks/settings)
+        self.num_chunks = len(self.chunks) if self.chunks is not None else 0
         if not self._index_exists():
+            if chunks is None:
+                raise FileNotFoundError(f"No finished index found at {self.index_dir}")
             print("Building Pyserini index...")
             self._build_index()
             print("Index built successfully.")
         else:
-            print("Loading existing index...")
+            print(f"Loading cached index (fingerprint {self.fingerprint[:16]})...")
         
-        # Initialize searcher
-        self.searcher = LuceneSearcher(self.index_dir)
+        self._open_searcher()
         
-
-        # Configure BM25 parameters based on language
+        if self.chunks is None:
+            # Hits are materialized from the stored raw documents on demand
+            self._get_chunk = lru_cache(maxsize=4096)(self._load_chunk)
+        print(f"Retriever initialized with {self.num_chunks} chunks.")
+    
+    def bm25_params(self):
         if self.language == "zh":
             # Chinese optimization
-            self.searcher.set_bm25(k1=1.2, b=0.3)
-        else:
-            # English/Default optimization
-            self.searcher.set_bm25(k1=0.9, b=0.4)
-
-        # Enable RM3 Query Expansion (Improves recall)
-        # fb_terms=10: number of expansion terms
-        # fb_docs=10: number of expansion documents
-        # original_query_weight=0.5: weight of original query
-        self.searcher.set_rm3(fb_terms=10, fb_docs=10, original_query_weight=0.5)        
+            return {'k1': 1.2, 'b': 0.3}
+        # English/Default optimization
+        return {'k1': 0.9, 'b': 0.4}
+    
+    def cache_settings(self):
+        """Search settings that change results, for result caches (the index itself is versioned by fingerprint)"""
+        return {
+            'retriever': 'pyserini',
+            'language': self.language,
+            'bm25': self.bm25_params(),
+            'rm3': self.rm3,
+            'rm3_min_margin': self.rm3_min_margin,
+            'rm3_params': [RM3_FB_TERMS, RM3_FB_DOCS, RM3_ORIGINAL_QUERY_WEIGHT],
+        }
+    
+    def _new_searcher(self, rm3):
+        searcher = LuceneSearcher(self.index_dir)
+        
+        # Configure BM25 parameters based on language
+        searcher.set_bm25(**self.bm25_params())
+
+        if rm3:
+            # Enable RM3 Query Expansion (Improves recall)
+            # fb_terms=10: number of expansion terms
+            # fb_docs=10: number of expansion documents
+            # original_query_weight=0.5: weight of original query
+            searcher.set_rm3(fb_terms=RM3_FB_TERMS, fb_docs=RM3_FB_DOCS,
+                             original_query_weight=RM3_ORIGINAL_QUERY_WEIGHT)
         # Set language for analyzer (important for Chinese)
-        if language == "zh":
+        if self.language == "zh":
             # Pyserini uses CJK analyzer for Chinese
-            self.searcher.set_language('zh')
-        
-        print(f"Retriever initialized with {len(chunks)} chunks.")
+            searcher.set_language('zh')
+        return searcher
+    
+    def _open_searcher(self):
+        """Initialize searcher"""
+        self.searcher = self._new_searcher(rm3=self.rm3 == "always")
+        # Adaptive mode keeps a second, RM3-enabled searcher for weak first passes
+        self.rm3_searcher = self._new_searcher(rm3=True) if self.rm3 == "adaptive" else None
+        # Pyserini refuses RM3 on Lucene Query objects, so filtered searches need a plain searcher
+        self.filter_searcher = self._new_searcher(rm3=False) if self.rm3 == "always" else self.searcher
+    
+    def _close_searchers(self):
+        """Closes every open searcher (plain, RM3 and filter) once"""
+        searchers = [getattr(self, name, None) for name in ('searcher', 'rm3_searcher', 'filter_searcher')]
+        closed = []
+        for searcher in searchers:
+            if searcher is not None and not any(searcher is other for other in closed):
+                searcher.close()
+                closed.append(searcher)
+        self.searcher = self.rm3_searcher = self.filter_searcher = None
+    
+    def _load_chunk(self, doc_id):
+        doc = self.searcher.doc(str(doc_id))
+        if doc is None:
+            return None
+        raw = json.loads(doc.raw())
+        return {
+            'page_content': raw['contents'],
+            'metadata': json.loads(raw.get('metadata') or '{}')
+        }
+    
+    def _get_chunk(self, doc_id):
+        if doc_id < len(self.chunks):
+            return self.chunks[doc_id]
+        return None
+    
+    def _hits_to_results(self, hits, with_scores=False):
+        """Convert hits back to original chunk format"""
+        results = []
+        for hit in hits:
+            chunk = self._get_chunk(int(hit.docid))
+            if chunk is not None:
+                results.append((chunk, hit.score) if with_scores else chunk)
+        return results
+    
+    def _indexer_args(self):
+        return indexer_args_for(self.language)
+    
+    def _compute_fingerprint(self):
+        """Hash of chunk texts, chunking parameters and indexer arguments"""
+        h = hashlib.sha256()
+        header = config_header(self.language, self.chunk_params)
+        if self.source_fingerprint is not None:
+            header['source'] = self.source_fingerprint
+            h.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+            return h.hexdigest()
+        header['num_chunks'] = len(self.chunks)
+        h.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+        for chunk in self.chunks:
+            text = chunk['page_content'].encode('utf-8')
+            # Length prefix keeps chunk boundaries part of the hash
+            h.update(len(text).to_bytes(8, 'little'))
+            h.update(text)
+        return h.hexdigest()
     
     def _index_exists(self):
-        """Check if index already exists"""
-        # Check for key Lucene index files
-        required_files = ['segments_1']  # Lucene index marker file
-        return all((Path(self.index_dir) / f).exists() for f in required_files)
+        """Check if a finished index built from the same fingerprint exists"""
+        meta_path = Path(self.index_dir) / INDEX_META_FILE
+        if not meta_path.exists():
+            return False
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if self.fingerprint is None:
+            # Opening an existing index as is
+            self.fingerprint = meta.get('fingerprint')
+        elif meta.get('fingerprint') != self.fingerprint:
+            print("Index fingerprint mismatch, rebuilding...")
+            return False
+        self.num_chunks = meta.get('num_chunks', 0)
+        return True
     
     def _build_index(self):
-        """Build Pyserini index from chunks"""
-        # Create temporary collection directory
-        collection_dir = tempfile.mkdtemp(prefix="pyserini_collection_")
+        """Build Pyserini index from chunks, feeding them to Lucene in-process"""
+        from pyserini.index.lucene import LuceneIndexer
+        
+        # Build into a staging directory and swap it in at the end, so an
+        # interrupted build never leaves a half-written index behind
+        index_path = Path(self.index_dir)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f".{index_path.name}.", dir=index_path.parent)
         
         try:
-            # Write documents in JSONL format
-            docs_file = os.path.join(collection_dir, 'documents.jsonl')
-            with open(docs_file, 'w', encoding='utf-8') as f:
-                for i, chunk in enumerate(self.chunks):
-                    doc = {
-                        'id': str(i),
-                        'contents': chunk['page_content'],
-                        # Store metadata if needed
-                        'metadata': json.dumps(chunk.get('metadata', {}), ensure_ascii=False)
-                    }
-                    f.write(json.dumps(doc, ensure_ascii=False) + '\n')
+            # LuceneIndexer appends '-input/-collection/-threads' itself
+            indexer_args = ['-index', staging_dir] + self._indexer_args()
+            indexer = LuceneIndexer(args=indexer_args, threads=self.index_threads)
             
-            # Build index using pyserini
-            from pyserini.index.lucene import LuceneIndexer
+            start = time.perf_counter()
+            chunk_doc_ids = []
+            source = self.chunks if self.chunks is not None else self._chunk_stream
+            self._index_chunks(indexer, enumerate(source), chunk_doc_ids)
+            indexer.close()
+            num_docs = len(chunk_doc_ids)
             
-            indexer_args = [
-                '--collection', 'JsonCollection',
-                '--input', collection_dir,
-                '--index', self.index_dir,
-                '--generator', 'DefaultLuceneDocumentGenerator',
-                '--threads', '1',
-                '--storePositions',
-                '--storeDocvectors',
-                '--storeRaw'
-            ]
+            elapsed = time.perf_counter() - start
+            self.num_chunks = num_docs
+            print(f"Indexed {num_docs} chunks in {elapsed:.2f}s "
+                  f"({num_docs / max(elapsed, 1e-9):.0f} docs/sec, {self.index_threads} threads)")
             
-            # Add language-specific settings
-            if self.language == 'zh':
-                indexer_args.extend(['--language', 'zh'])
+            # Chunk ids per document, for incremental updates
+            save_manifest(os.path.join(staging_dir, MANIFEST_FILE),
+                          build_manifest(chunk_doc_ids, self.doc_hashes))
             
-            # Run indexer
-            import sys
-            from io import StringIO
-            
-            # Capture stdout to reduce verbosity
-            old_stdout = sys.stdout
-            sys.stdout = StringIO()
+            # Mark the index as complete, then replace any stale index
+            self._write_meta(staging_dir, num_docs)
+            if index_path.exists():
+                shutil.rmtree(index_path)
+            os.replace(staging_dir, index_path)
+        
+        finally:
+            # Clean up the staging directory if the build failed
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    def _index_chunks(self, indexer, id_chunk_pairs, chunk_doc_ids):
+        """Feeds (id, chunk) pairs to a LuceneIndexer in batches, recording each chunk's doc_id"""
+        batch = []
+        for chunk_id, chunk in id_chunk_pairs:
+            metadata = chunk.get('metadata', {})
+            batch.append(json.dumps({
+                'id': str(chunk_id),
+                'contents': chunk['page_content'],
+                # Store metadata if needed
+                'metadata': json.dumps(metadata, ensure_ascii=False)
+            }, ensure_ascii=False))
+            chunk_doc_ids.append(metadata.get('doc_id'))
+            if len(batch) >= self.index_batch_size:
+                # Each batch is indexed in parallel by the indexer's thread pool
+                indexer.add_batch_raw(batch)
+                batch = []
+        if batch:
+            indexer.add_batch_raw(batch)
+    
+    def _write_meta(self, index_dir, num_chunks):
+        with open(os.path.join(index_dir, INDEX_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'fingerprint': self.fingerprint,
+                'source_fingerprint': self.source_fingerprint,
+                'language': self.language,
+                'chunk_params': self.chunk_params,
+                'indexer_args': self._indexer_args(),
+                'num_chunks': num_chunks,
+            }, f, ensure_ascii=False, indent=2)
+    
+    def update_documents(self, docs):
+        """
+        Incrementally syncs the index with a new version of the corpus.
+        
+        Documents are diffed against the corpus manifest by doc_id and content
+        hash; only added and changed documents are re-chunked, the chunks of
+        changed and removed documents are deleted, and new chunks get fresh ids
+        (ids are never reused, so chunk ids already handed out stay valid).
+        
+        Args:
+            docs: Iterable of documents (other languages are ignored)
             
-            try:
-                # Use pyserini's command-line interface
-                import subprocess
-                # Use sys.executable to get the current Python interpreter (works in venv)
-                cmd = [sys.executable, '-m', 'pyserini.index.lucene'] + indexer_args
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                
-                if result.returncode != 0:
-                    # Restore stdout and show error
-                    sys.stdout = old_stdout
-                    print(f"Indexing stderr: {result.stderr}")
-                    raise RuntimeError(f"Indexing failed: {result.stderr}")
-            finally:
-                sys.stdout = old_stdout
+        Returns:
+            CorpusDiff describing what changed
+        """
+        from pyserini.index.lucene import LuceneIndexer
+        
+        start = time.perf_counter()
+        manifest_path = os.path.join(self.index_dir, MANIFEST_FILE)
+        manifest = load_manifest(manifest_path)
+        docs = [doc for doc in docs if is_chunkable(doc, self.language)]
+        diff = diff_documents(manifest, docs)
+        if diff.is_empty:
+            print(f"Index up to date ({diff}).")
+            return diff
+        
+        deleted_ids, new_chunks = apply_diff(manifest, diff, self.language,
+                                             self.chunk_params.get('chunk_size', 500),
+                                             self.chunk_params.get('chunk_overlap', 150))
+        
+        self._close_searchers()
+        self._delete_chunks(deleted_ids)
+        indexer = LuceneIndexer(args=['-index', self.index_dir] + self._indexer_args(),
+                                append=True, threads=self.index_threads)
+        self._index_chunks(indexer, new_chunks, [])
+        indexer.close()
         
+        # Chunk ids are now sparse: resolve hits through the stored documents
+        self.num_chunks = sum(len(entry['chunk_ids']) for entry in manifest['docs'].values())
+        self.fingerprint = hashlib.sha256(json.dumps({
+            **config_header(self.language, self.chunk_params),
+            'corpus': corpus_hash(manifest),
+        }, sort_keys=True).encode('utf-8')).hexdigest()
+        save_manifest(manifest_path, manifest)
+        self._write_meta(self.index_dir, self.num_chunks)
+        
+        self.chunks = None
+        self._get_chunk = lru_cache(maxsize=4096)(self._load_chunk)
+        self._open_searcher()
+        print(f"Index updated ({diff}): -{len(deleted_ids)} / +{len(new_chunks)} chunks "
+              f"in {time.perf_counter() - start:.2f}s")
+        return diff
+    
+    def _delete_chunks(self, chunk_ids):
+        """Deletes chunks by their 'id' field with a Lucene IndexWriter"""
+        if not chunk_ids:
+            return
+        from jnius import autoclass
+        JFile = autoclass('java.io.File')
+        JFSDirectory = autoclass('org.apache.lucene.store.FSDirectory')
+        JIndexWriter = autoclass('org.apache.lucene.index.IndexWriter')
+        JIndexWriterConfig = autoclass('org.apache.lucene.index.IndexWriterConfig')
+        JTerm = autoclass('org.apache.lucene.index.Term')
+        
+        directory = JFSDirectory.open(JFile(self.index_dir).toPath())
+        writer = JIndexWriter(directory, JIndexWriterConfig())
+        try:
+            for chunk_id in chunk_ids:
+                writer.deleteDocuments(JTerm('id', str(chunk_id)))
+            writer.commit()
         finally:
-            # Clean up collection directory
-            shutil.rmtree(collection_dir, ignore_errors=True)
+            writer.close()
+            directory.close()
+    
+    def _filtered_query(self, query, allowed_ids):
+        """
+        Lucene query scoring the query's terms (BM25, bag of words) only over the
+        chunks whose 'id' is in allowed_ids. The id filter is a non-scoring
+        FILTER clause, so scores match an unfiltered search without RM3.
+        """
+        from jnius import autoclass
+        from pyserini.analysis import get_lucene_analyzer
+        if self._query_classes is None:
+            self._query_classes = (
+                autoclass('io.anserini.search.query.BagOfWordsQueryGenerator')(),
+                get_lucene_analyzer(language=self.language),
+                autoclass('org.apache.lucene.search.BooleanQuery$Builder'),
+                autoclass('org.apache.lucene.search.BooleanClause$Occur'),
+                autoclass('org.apache.lucene.search.TermInSetQuery'),
+                autoclass('org.apache.lucene.util.BytesRef'),
+                autoclass('java.util.ArrayList'),
+            )
+        generator, analyzer, JBooleanQueryBuilder, JOccur, JTermInSetQuery, JBytesRef, JArrayList = self._query_classes
+        ids = JArrayList()
+        for chunk_id in allowed_ids:
+            ids.add(JBytesRef(str(chunk_id)))
+        builder = JBooleanQueryBuilder()
+        builder.add(generator.buildQuery('contents', analyzer, query), JOccur.MUST)
+        builder.add(JTermInSetQuery('id', ids), JOccur.FILTER)
+        return builder.build()
+    
+    def _log_feedback(self, query, weak, margin, first_pass_s, rm3_s):
+        self.feedback_log.append({
+            'query': query,
+            'rm3': weak,
+            'margin': None if margin is None else round(float(margin), 4),
+            'first_pass_ms': round(first_pass_s * 1000, 2),
+            'rm3_ms': round(rm3_s * 1000, 2),
+        })
+    
+    def _adaptive_search(self, query, top_k):
+        """Plain BM25 first; RM3 only when that ranking looks weak"""
+        start = time.perf_counter()
+        # At least fb_docs hits, so the margin looks at the same depth RM3 would feed back from
+        hits = self.searcher.search(query, k=max(top_k, RM3_FB_DOCS))
+        first_pass_s = time.perf_counter() - start
+        weak, margin = is_weak_first_pass([hit.score for hit in hits], min_margin=self.rm3_min_margin)
+        rm3_s = 0.0
+        if weak:
+            start = time.perf_counter()
+            hits = self.rm3_searcher.search(query, k=top_k)
+            rm3_s = time.perf_counter() - start
+        self._log_feedback(query, weak, margin, first_pass_s, rm3_s)
+        return hits[:top_k]
+    
+    def _adaptive_batch_search(self, queries, qids, top_k, threads):
+        """Batch version of _adaptive_search; logged timings are the per-query share of each batch"""
+        start = time.perf_counter()
+        batch_hits = self.searcher.batch_search(queries, qids, k=max(top_k, RM3_FB_DOCS), threads=threads)
+        first_pass_s = (time.perf_counter() - start) / len(queries)
+        decisions = {qid: is_weak_first_pass([hit.score for hit in batch_hits.get(qid, [])],
+                                             min_margin=self.rm3_min_margin)
+                     for qid in qids}
+        weak = [(query, qid) for query, qid in zip(queries, qids) if decisions[qid][0]]
+        rm3_s = 0.0
+        if weak:
+            start = time.perf_counter()
+            batch_hits.update(self.rm3_searcher.batch_search([query for query, _ in weak], [qid for _, qid in weak],
+                                                             k=top_k, threads=threads))
+            rm3_s = (time.perf_counter() - start) / len(weak)
+        for query, qid in zip(queries, qids):
+            is_weak, margin = decisions[qid]
+            self._log_feedback(query, is_weak, margin, first_pass_s, rm3_s if is_weak else 0.0)
+        return {qid: batch_hits.get(qid, [])[:top_k] for qid in qids}
+    
+    def feedback_summary(self) -> str:
+        """How often adaptive RM3 fired and what each pass cost"""
+        if not self.feedback_log:
+            return f"RM3 feedback: {self.rm3} (no adaptive decisions)"
+        expanded = [entry for entry in self.feedback_log if entry['rm3']]
+        first_pass_ms = sum(entry['first_pass_ms'] for entry in self.feedback_log) / len(self.feedback_log)
+        rm3_ms = sum(entry['rm3_ms'] for entry in expanded) / len(expanded) if expanded else 0.0
+        return (f"RM3 feedback (adaptive, margin < {self.rm3_min_margin}): {len(expanded)}/{len(self.feedback_log)} "
+                f"queries expanded, first pass {first_pass_ms:.1f}ms, RM3 pass {rm3_ms:.1f}ms mean")
+    
+    def save_feedback_log(self, path):
+        """Writes the per-query adaptive RM3 decisions as JSON lines"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for entry in self.feedback_log:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
     
-    def retrieve(self, query, top_k=5):
+    def _search(self, query, top_k, allowed_ids=None):
+        if allowed_ids is None:
+            if self.rm3 == "adaptive":
+                return self._adaptive_search(query, top_k)
+            return self.searcher.search(query, k=top_k)
+        if len(allowed_ids) == 0:
+            return []
+        # RM3 feedback would pull expansion terms from the whole corpus; the
+        # entity filter already narrows the candidates, so it runs without RM3
+        return self.filter_searcher.search(self._filtered_query(query, allowed_ids), k=top_k)
+    
+    def retrieve(self, query, top_k=5, allowed_ids=None):
         """
         Retrieve most relevant chunks for a query.
         
         Args:
             query: Query string
             top_k: Number of results to return
+            allowed_ids: Optional chunk ids to search instead of the whole index
             
         Returns:
             List of chunk dictionaries
         """
         # Search using Pyserini
-        hits = self.searcher.search(query, k=top_k)
-        
-        # Convert hits back to original chunk format
-        results = []
-        for hit in hits:
-            doc_id = int(hit.docid)
-            if doc_id < len(self.chunks):
-                results.append(self.chunks[doc_id])
-        
-        return results
+        hits = self._search(query, top_k, allowed_ids)
+        return self._hits_to_results(hits)
     
-    def retrieve_with_scores(self, query, top_k=5):
+    def retrieve_with_scores(self, query, top_k=5, allowed_ids=None):
         """
         Retrieve chunks with their BM25 scores.
         
         Args:
             query: Query string
             top_k: Number of results to return
+            allowed_ids: Optional chunk ids to search instead of the whole index
             
         Returns:
             List of tuples (chunk, score)
         """
-        hits = self.searcher.search(query, k=top_k)
+        hits = self._search(query, top_k, allowed_ids)
+        return self._hits_to_results(hits, with_scores=True)
+    
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        """
+        Retrieve chunks for many queries with one multi-threaded batch search.
         
-        results = []
-        for hit in hits:
-            doc_id = int(hit.docid)
-            if doc_id < len(self.chunks):
-                results.append((self.chunks[doc_id], hit.score))
+        Args:
+            queries: List of query strings
+            top_k: Number of results to return per query
+            threads: Search threads. Defaults to the number of CPU cores
+            with_scores: Return (chunk, score) tuples instead of chunks
+            allowed_ids: Optional list with, per query, the chunk ids it may
+                return (None: the whole index). Filtered queries are searched
+                one by one; the rest still go through one batch search.
+            
+        Returns:
+            List of result lists, in the same order as queries
+        """
+        if not queries:
+            return []
+        threads = threads or os.cpu_count() or 1
+        allowed_ids = allowed_ids or [None] * len(queries)
+        unfiltered = [i for i, ids in enumerate(allowed_ids) if ids is None]
+        qids = [str(i) for i in unfiltered]
+        batch_hits = {}
+        if qids:
+            if self.rm3 == "adaptive":
+                batch_hits = self._adaptive_batch_search([queries[i] for i in unfiltered], qids, top_k, threads)
+            else:
+                # One JVM call; Lucene runs the searches on its own thread pool
+                batch_hits = self.searcher.batch_search([queries[i] for i in unfiltered], qids, k=top_k,
+                                                        threads=threads)
         
-        return results
+        all_results = []
+        for i, (query, ids) in enumerate(zip(queries, allowed_ids)):
+            hits = batch_hits.get(str(i), []) if ids is None else self._search(query, top_k, ids)
+            all_results.append(self._hits_to_results(hits, with_scores))
+        return all_results
     
     def __del__(self):
-        """Cleanup index directory if not keeping"""
+        """Close the searchers, then cleanup index directory if not keeping"""
+        try:
+            self._close_searchers()
+        except Exception:
+            # The JVM may already be gone at interpreter shutdown
+            pass
         if not self.keep_index and hasattr(self, 'index_dir'):
             if os.path.exists(self.index_dir):
                 shutil.rmtree(self.index_dir, ignore_errors=True)
 
 
-def create_retriever(chunks, language, index_dir=None, keep_index=True):
+def create_retriever(chunks, language, index_dir=None, keep_index=True, chunk_params=None, cache_dir=None,
+                     index_threads=None, source_fingerprint=None, rm3="always"):
     """
     Creates a Pyserini retriever from document chunks.
     
@@ -192,8 +617,55 @@ def create_retriever(chunks, language, index_dir=None, keep_index=True):
         language: Language code ('en' or 'zh')
         index_dir: Optional directory to save index (for reuse)
         keep_index: Whether to persist index after program ends
+        chunk_params: Chunking parameters, included in the index cache key
+        cache_dir: Root of the index cache (defaults to ./index_cache)
+        index_threads: Lucene indexing threads (defaults to CPU count)
+        source_fingerprint: Cache key of the chunk source; required when chunks is a generator
+        rm3: RM3 feedback mode ('always', 'adaptive' or 'off')
         
     Returns:
         PyseriniRetriever instance
     """
-    return PyseriniRetriever(chunks, language, index_dir=index_dir, keep_index=keep_index)
+    return PyseriniRetriever(chunks, language, index_dir=index_dir, keep_index=keep_index,
+                             chunk_params=chunk_params, cache_dir=cache_dir, index_threads=index_threads,
+                             source_fingerprint=source_fingerprint, rm3=rm3)
+
+
+def create_incremental_retriever(docs, language, chunk_params, index_dir=None, cache_dir=None, index_threads=None,
+                                 rm3="always"):
+    """
+    Creates a Pyserini retriever over a long-lived index that is updated in place.
+    
+    The first call chunks and indexes the whole corpus; later calls diff docs
+    against the index's corpus manifest and only re-index what changed.
+    
+    Args:
+        docs: Documents (all languages; filtered here)
+        language: Language code ('en' or 'zh')
+        chunk_params: dict with chunk_size and chunk_overlap
+        index_dir: Location of the live index. Defaults to index_cache/<language>_live_<config hash>
+        cache_dir: Root of the index cache (defaults to ./index_cache)
+        index_threads: Lucene indexing threads (defaults to CPU count)
+        rm3: RM3 feedback mode ('always', 'adaptive' or 'off')
+        
+    Returns:
+        PyseriniRetriever instance
+    """
+    docs = [doc for doc in docs if is_chunkable(doc, language)]
+    if index_dir is None:
+        config_hash = hashlib.sha256(json.dumps(config_header(language, chunk_params), sort_keys=True)
+                                     .encode('utf-8')).hexdigest()
+        cache_root = Path(cache_dir) if cache_dir else DEFAULT_INDEX_CACHE
+        index_dir = cache_root / f"{language}_live_{config_hash[:16]}"
+    index_dir = Path(index_dir)
+    
+    if (index_dir / INDEX_META_FILE).exists() and (index_dir / MANIFEST_FILE).exists():
+        retriever = PyseriniRetriever(None, language, index_dir=index_dir, chunk_params=chunk_params,
+                                      index_threads=index_threads, rm3=rm3)
+        retriever.update_documents(docs)
+        return retriever
+    
+    chunks = chunk_documents(docs, language, **chunk_params)
+    doc_hashes = {str(doc.get('doc_id')): document_hash(doc) for doc in docs}
+    return PyseriniRetriever(chunks, language, index_dir=index_dir, chunk_params=chunk_params,
+                             index_threads=index_threads, doc_hashes=doc_hashes, rm3=rm3)
@@ -0,0 +1,105 @@
+"""
+Query analysis stage: one structured LLM call per query that replaces the
+separate expand_query and LLM-router generations.
+
+The model is constrained by a JSON schema and returns the expanded keywords,
+the prompt template to use and the entities (company names, dates) it found.
+"""
+import json
+from selector import load_templates, classify_template
+from utils import get_llm_client
+
+
+TEMPLATE_USE_CASES = {
+    "qa_expert.txt": "a specific question looking for a precise answer",
+    "summary_report.txt": "a summary, overview or general understanding of a company or record",
+    "data_extraction.txt": "extracting data, listing metrics or events, building a table",
+    "comparison.txt": "comparing two or more entities, years or metrics, or asking which happened earlier",
+}
+
+
+def _analysis_schema(template_names: list) -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "keywords": {"type": "string"},
+            "template": {"type": "string", "enum": template_names},
+            "company_names": {"type": "array", "items": {"type": "string"}},
+            "dates": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["keywords", "template", "company_names", "dates"],
+    }
+
+
+def _analysis_prompt(query_text: str, language: str, template_names: list) -> str:
+    keyword_language = " in Simplified Chinese" if language == 'zh' else ""
+    template_lines = "\n".join(
+        f"- {name}: {TEMPLATE_USE_CASES.get(name, 'general use')}" for name in template_names
+    )
+    return f"""You are a search query analyzer. Analyze the user's query and answer in JSON.
+
+- keywords: an expanded keyword string{keyword_language} containing synonyms, relevant entities and keywords to improve retrieval recall.
+- template: the answer template that fits the query best:
+{template_lines}
+- company_names: company or organization names mentioned in the query, exactly as written.
+- dates: years or dates mentioned in the query, exactly as written.
+
+Query: {query_text}
+"""
+
+
+def _parse_analysis(query_text: str, response: str, template_names: list) -> dict:
+    try:
+        analysis = json.loads(response)
+        if not isinstance(analysis, dict):
+            raise ValueError("analysis is not an object")
+    except ValueError:
+        if response:
+            print(f"Warning: Could not parse query analysis: {response[:200]}")
+        analysis = {}
+
+    template = analysis.get("template")
+    if template not in template_names:
+        template, _ = classify_template(query_text)
+    return {
+        "keywords": str(analysis.get("keywords") or ""),
+        "template": template,
+        "company_names": [c for c in analysis.get("company_names") or [] if isinstance(c, str)],
+        "dates": [d for d in analysis.get("dates") or [] if isinstance(d, str)],
+    }
+
+
+def analyze_query(query_text: str, language: str) -> dict:
+    """
+    Expands the query and picks its template in one LLM call.
+
+    Returns:
+        dict with 'keywords' (str), 'template' (template filename),
+        'company_names' (list of str) and 'dates' (list of str)
+    """
+    template_names = sorted(load_templates())
+    try:
+        response = get_llm_client().generate(
+            _analysis_prompt(query_text, language, template_names),
+            tag="analyze",
+            format=_analysis_schema(template_names)
+        )
+    except Exception as e:
+        response = ""
+        print(f"Error using Ollama Python client: {e}")
+    return _parse_analysis(query_text, response, template_names)
+
+
+async def analyze_query_async(query_text: str, language: str) -> dict:
+    """Async variant of analyze_query for the concurrent pipeline."""
+    template_names = sorted(load_templates())
+    try:
+        response = await get_llm_client().generate_async(
+            _analysis_prompt(query_text, language, template_names),
+            tag="analyze",
+            format=_analysis_schema(template_names)
+        )
+    except Exception as e:
+        response = ""
+        print(f"Error using Ollama Python client: {e}")
+    return _parse_analysis(query_text, response, template_names)
@@ -0,0 +1,217 @@
+"""
+In-process LRU/TTL cache of retrieval results.
+
+Entries are keyed by the normalized query text, top_k, a hash of the
+retriever's settings and the index version, and hold chunk-id and score
+arrays rather than chunks. A rebuilt or updated index has a new version
+(fingerprint), so stale entries are never served and are dropped when the
+change is noticed.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+import numpy as np
+
+
+DEFAULT_MAX_ENTRIES = 10_000
+DEFAULT_TTL_SECONDS = 3600
+# Attributes holding a wrapped retriever (EntityFilteredRetriever, HybridRetriever)
+_NESTED_RETRIEVERS = ("retriever", "sparse", "dense")
+# Attributes that identify the indexed corpus rather than search settings
+_VERSION_ATTRIBUTES = ("fingerprint", "index_version")
+
+
+def normalize_query(query):
+    """
+    Cache key text: NFKC, case-folded, punctuation replaced by spaces and
+    whitespace collapsed. Variants that differ only in those ways share results.
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = "".join(" " if unicodedata.category(char).startswith("P") else char for char in text)
+    return " ".join(text.split())
+
+
+def _retriever_tree(retriever):
+    """The retriever followed by the retrievers it wraps, depth first."""
+    stack = [retriever]
+    while stack:
+        current = stack.pop()
+        yield current
+        attributes = vars(current) if hasattr(current, "__dict__") else {}
+        stack.extend(attributes[name] for name in reversed(_NESTED_RETRIEVERS) if attributes.get(name) is not None)
+
+
+def config_hash(retriever):
+    """Hash of the retriever's cache_settings() (language, RM3 mode, nprobe, fusion, weights, ...)."""
+    settings = retriever.cache_settings()
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def index_version(retriever):
+    """Index fingerprints / update counters of a retriever and those it wraps."""
+    return "|".join(str(getattr(current, name, None)) for current in _retriever_tree(retriever)
+                    for name in _VERSION_ATTRIBUTES)
+
+
+def _allowlist_key(ids):
+    if ids is None:
+        return None
+    return hashlib.sha256(np.asarray(ids, dtype=np.int64).tobytes()).hexdigest()[:16]
+
+
+class CachedRetriever:
+
+    def __init__(self, retriever, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS):
+        """
+        Wraps a retriever with a result cache.
+
+        Args:
+            retriever: Any retriever with cache_settings() and retrieve_batch(..., with_scores=True)
+            max_entries: Cached queries before least recently used ones are evicted
+            ttl: Seconds an entry stays valid (None: until evicted or the index changes)
+        """
+        self.retriever = retriever
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # chunk_index -> chunk for every chunk referenced by a cached entry
+        self._chunks = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # timing_summary, filter_summary, update_documents, ... go to the wrapped retriever
+        return getattr(self.retriever, name)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._chunks.clear()
+
+    def _check_version(self):
+        """Drops every entry when the index has been rebuilt or updated."""
+        version = index_version(self.retriever)
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    print("Index changed, clearing the retrieval cache")
+                self._entries.clear()
+                self._chunks.clear()
+                self._version = version
+        return version
+
+    def _get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl is not None and now - entry[2] > self.ttl):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _put(self, key, results, now):
+        ids = np.array([chunk['metadata']['chunk_index'] for chunk, _ in results], dtype=np.int64)
+        scores = np.array([score for _, score in results], dtype=np.float32)
+        with self._lock:
+            for chunk, _ in results:
+                self._chunks[chunk['metadata']['chunk_index']] = chunk
+            self._entries[key] = (ids, scores, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return ids, scores
+
+    def retrieve_ids_batch(self, queries, top_k=5, threads=None, allowed_ids=None):
+        """
+        Cached chunk ids and scores for every query; only misses reach the retriever.
+
+        Args:
+            queries: List of query strings
+            top_k: Number of results per query
+            threads: Search threads for the wrapped retriever
+            allowed_ids: Optional per-query chunk allowlists (part of the key)
+
+        Returns:
+            List of (chunk ids, scores) numpy arrays, best first, in the same order as queries
+        """
+        if not queries:
+            return []
+        version = self._check_version()
+        settings = config_hash(self.retriever)
+        # Given allowlists are passed on even when all are None, so an entity filter
+        # below does not compute its own from the (expanded) query text
+        pass_allowed_ids = allowed_ids is not None
+        allowed_ids = allowed_ids or [None] * len(queries)
+        now = time.time()
+        keys = [(normalize_query(query), top_k, settings, version, _allowlist_key(ids))
+                for query, ids in zip(queries, allowed_ids)]
+
+        found = {}
+        missing = {}
+        for i, key in enumerate(keys):
+            entry = found.get(key) or self._get(key, now)
+            if entry is not None:
+                found[key] = entry[:2]
+            else:
+                # Repeats of a missing query within the batch are searched once
+                missing.setdefault(key, i)
+        if missing:
+            positions = list(missing.values())
+            kwargs = {}
+            if pass_allowed_ids:
+                kwargs["allowed_ids"] = [allowed_ids[i] for i in positions]
+            fresh = self.retriever.retrieve_batch([queries[i] for i in positions], top_k=top_k, threads=threads,
+                                                  with_scores=True, **kwargs)
+            for key, results in zip(missing, fresh):
+                found[key] = self._put(key, results, now)
+        return [found[key] for key in keys]
+
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        """
+        Same contract as the wrapped retriever's retrieve_batch, served from the cache when possible.
+
+        Returns:
+            List of result lists, in the same order as queries
+        """
+        all_results = []
+        for ids, scores in self.retrieve_ids_batch(queries, top_k=top_k, threads=threads, allowed_ids=allowed_ids):
+            chunks = [self._chunks[int(idx)] for idx in ids]
+            all_results.append([(chunk, float(score)) for chunk, score in zip(chunks, scores)]
+                               if with_scores else chunks)
+        return all_results
+
+    def retrieve(self, query, top_k=5, allowed_ids=None):
+        return self.retrieve_batch([query], top_k=top_k, allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def retrieve_with_scores(self, query, top_k=5, allowed_ids=None):
+        return self.retrieve_batch([query], top_k=top_k, with_scores=True,
+                                   allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def cache_summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (f"Retrieval cache: {self.hits} hits / {self.misses} misses ({rate:.0%} hit rate), "
+                f"{len(self._entries)} entries")
+
+
+def create_cached_retriever(retriever, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS):
+    """
+    Wraps a retriever with an LRU/TTL result cache.
+
+    Args:
+        retriever: Any retriever (wrap it last, outside an entity filter)
+        max_entries: Maximum cached queries
+        ttl: Entry lifetime in seconds (None: no expiry)
+
+    Returns:
+        CachedRetriever instance
+    """
+    return CachedRetriever(retriever, max_entries=max_entries, ttl=ttl)
@@ -1,25 +1,101 @@
-from rank_bm25 import BM25Okapi
-import jieba
+from bm25_engine import SparseBM25
+from chunker import is_chunkable
+from incremental import apply_diff, build_manifest, diff_documents
+from tokenization import tokenize_corpus, tokenize_query, warm_up
 
 class BM25Retriever:
-    def __init__(self, chunks, language="en"):
+    def __init__(self, chunks, language="en", tokenize_workers=1):
         self.chunks = chunks
         self.language = language
-        self.corpus = [chunk['page_content'] for chunk in chunks]
+        self.tokenize_workers = tokenize_workers
         if language == "zh":
-            self.tokenized_corpus = [list(jieba.cut(doc)) for doc in self.corpus]
-        else:
-            self.tokenized_corpus = [doc.split(" ") for doc in self.corpus]
-        self.bm25 = BM25Okapi(self.tokenized_corpus)
-
-    def retrieve(self, query, top_k=5):
-        if self.language == "zh":
-            tokenized_query = list(jieba.cut(query))
-        else:
-            tokenized_query = query.split(" ")
-        top_chunks = self.bm25.get_top_n(tokenized_query, self.chunks, n=top_k)
-        return top_chunks
-
-def create_retriever(chunks, language):
+            warm_up()
+        # Integer vocabulary + CSR term counts; token lists are not kept
+        self.bm25 = SparseBM25().fit(self._tokenize_texts([chunk['page_content'] for chunk in chunks]))
+        # Built on the first update_documents call
+        self.manifest = None
+        self.chunk_ids = list(range(len(chunks)))
+        # Bumped by every update, so result caches notice the corpus changed
+        self.index_version = 0
+
+    def _tokenize_texts(self, texts):
+        return tokenize_corpus(texts, self.language, workers=self.tokenize_workers)
+
+    def _tokenize_query(self, query):
+        return tokenize_query(query, self.language)
+
+    def update_documents(self, docs, chunk_size=500, chunk_overlap=150, doc_hashes=None):
+        """Syncs the retriever with a new version of the corpus.
+
+        Only added and changed documents are chunked and tokenized; the term counts
+        of unchanged chunks are reused when the BM25 weights are rebuilt.
+
+        Args:
+            docs: Iterable of documents (other languages are ignored)
+            chunk_size, chunk_overlap: Must match how the initial chunks were made
+            doc_hashes: {doc_id: hash} of the initial corpus. Without it every
+                document is treated as changed on the first update.
+        """
+        if self.manifest is None:
+            self.manifest = build_manifest((chunk['metadata'].get('doc_id') for chunk in self.chunks), doc_hashes)
+        docs = [doc for doc in docs if is_chunkable(doc, self.language)]
+        diff = diff_documents(self.manifest, docs)
+        if diff.is_empty:
+            return diff
+
+        deleted_ids, new_chunks = apply_diff(self.manifest, diff, self.language, chunk_size, chunk_overlap)
+        deleted_ids = set(deleted_ids)
+        keep = [i for i, chunk_id in enumerate(self.chunk_ids) if chunk_id not in deleted_ids]
+        self.chunks = [self.chunks[i] for i in keep] + [chunk for _, chunk in new_chunks]
+        self.chunk_ids = [self.chunk_ids[i] for i in keep] + [chunk_id for chunk_id, _ in new_chunks]
+        self.bm25.update(keep, self._tokenize_texts([chunk['page_content'] for _, chunk in new_chunks]))
+        self.index_version += 1
+        print(f"BM25 index updated ({diff}): -{len(deleted_ids)} / +{len(new_chunks)} chunks")
+        return diff
+
+    def cache_settings(self):
+        """Search settings that change results, for result caches."""
+        return {'retriever': 'bm25', 'language': self.language,
+                'k1': self.bm25.k1, 'b': self.bm25.b, 'epsilon': self.bm25.epsilon}
+
+    def retrieve(self, query, top_k=5, allowed_ids=None):
+        return self.retrieve_batch([query], top_k=top_k,
+                                   allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def retrieve_with_scores(self, query, top_k=5, allowed_ids=None):
+        """Returns a list of (chunk, BM25 score) tuples, best first."""
+        return self.retrieve_batch([query], top_k=top_k, with_scores=True,
+                                   allowed_ids=None if allowed_ids is None else [allowed_ids])[0]
+
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        """Retrieves top_k chunks for every query.
+
+        All queries are scored together as sparse matrix products (queries x vocab
+        times vocab x chunks) and top_k is selected with argpartition.
+        allowed_ids optionally gives, per query, the chunk positions it may return
+        (None: all); such queries only score those chunks.
+        threads is accepted for interface parity with the other retrievers.
+        Results are returned in the same order as queries.
+        """
+        if not queries:
+            return []
+        allowed_ids = allowed_ids or [None] * len(queries)
+        tokenized_queries = [self._tokenize_query(query) for query in queries]
+        unfiltered = [i for i, ids in enumerate(allowed_ids) if ids is None]
+        matches = dict(zip(unfiltered, self.bm25.search_batch([tokenized_queries[i] for i in unfiltered], top_k)))
+        for i, ids in enumerate(allowed_ids):
+            if ids is not None:
+                matches[i] = self.bm25.search_subset(tokenized_queries[i], ids, top_k)
+
+        all_results = []
+        for i in range(len(queries)):
+            indices, scores = matches[i]
+            if with_scores:
+                all_results.append([(self.chunks[idx], float(score)) for idx, score in zip(indices, scores)])
+            else:
+                all_results.append([self.chunks[idx] for idx in indices])
+        return all_results
+
+def create_retriever(chunks, language, tokenize_workers=1):
     """Creates a BM25 retriever from document chunks."""
-    return BM25Retriever(chunks, language)
+    return BM25Retriever(chunks, language, tokenize_workers=tokenize_workers)
@@ -1,11 +1,22 @@
 """
 Selector module will select relevant prompt templates based on the query and relevant chunks.
+
+Routing is done by the local query-type classifier. When it is not
+confident, the LLM router is consulted (opt-in) or the default template is used.
 """
 import os
-from utils import llm_generate
+from functools import lru_cache
+from query_classifier import get_classifier
+from utils import llm_generate, llm_generate_async
+
+DEFAULT_TEMPLATE = "qa_expert.txt"
+# Below this classifier confidence the optional LLM router (or DEFAULT_TEMPLATE) is used instead
+MIN_CONFIDENCE = 0.6
 
-def select_prompt(query: str, context_chunks: list) -> str:
-    """Load all templates and use LLM to select the most relevant one."""
+
+@lru_cache(maxsize=1)
+def load_templates() -> dict:
+    """Reads template_pool once per process."""
     templates = {}
     # Use absolute path based on this file's location
     template_dir = os.path.join(os.path.dirname(__file__), "template_pool")
@@ -13,8 +24,11 @@ def select_prompt(query: str, context_chunks: list) -> str:
         if filename.endswith(".txt"):
             with open(os.path.join(template_dir, filename), 'r') as f:
                 templates[filename] = f.read()
+    return templates
+
 
-    """Selects the most relevant prompt template."""
+def _router_prompt(query: str, context_chunks: list, templates: dict) -> str:
+    """Builds the prompt asking the LLM to pick a template."""
     context = "\n\n".join([chunk['page_content'] for chunk in context_chunks])
     template_options = ""
     for name, content in templates.items():
@@ -24,7 +38,7 @@ def select_prompt(query: str, context_chunks: list) -> str:
         template_options += f"- Filename: `{name}`\n  Content Preview: {preview}...\n\n"
 
 
-    prompt = f"""
+    return f"""
     You are an expert AI Router. Your goal is to select the best prompt template for the user's request based on the context.
 
     Here are the available templates and their specific use cases:
@@ -39,12 +53,55 @@ def select_prompt(query: str, context_chunks: list) -> str:
     
     Answer strictly with the filename only (e.g., 'qa_expert.txt').
     """
-    
-    chosen_template_name = llm_generate(prompt).strip()
+
+
+def _resolve_template(templates: dict, llm_response: str, fallback_name: str) -> str:
+    chosen_template_name = llm_response.strip()
     
     chosen_template_name = chosen_template_name.replace("'", "").replace('"', "").replace("`", "")
-    print(f"[System] Selector chose: {chosen_template_name}")
-    return templates.get(chosen_template_name, "Error: Selected template not found in pool.")
+    if chosen_template_name not in templates:
+        # The router answered with something outside the pool; keep the classifier's pick
+        chosen_template_name = fallback_name
+    print(f"[System] Selector (LLM) chose: {chosen_template_name}")
+    return templates[chosen_template_name]
+
+
+def classify_template(query: str):
+    """Returns (template filename, confidence) from the local classifier."""
+    templates = load_templates()
+    name, confidence = get_classifier().predict(query)
+    if name not in templates:
+        name = DEFAULT_TEMPLATE
+    return name, confidence
+
+
+def select_prompt(query: str, context_chunks: list, llm_fallback: bool = False,
+                  min_confidence: float = MIN_CONFIDENCE) -> str:
+    """Selects the most relevant prompt template with the local classifier.
+
+    Low-confidence queries get DEFAULT_TEMPLATE, or are routed by the LLM with llm_fallback=True.
+    """
+    templates = load_templates()
+    name, confidence = classify_template(query)
+    if confidence < min_confidence:
+        if not llm_fallback:
+            return templates[DEFAULT_TEMPLATE]
+        response = llm_generate(_router_prompt(query, context_chunks, templates), tag="select")
+        return _resolve_template(templates, response, name)
+    return templates[name]
+
+
+async def select_prompt_async(query: str, context_chunks: list, llm_fallback: bool = False,
+                              min_confidence: float = MIN_CONFIDENCE) -> str:
+    """Async variant of select_prompt for the concurrent pipeline."""
+    templates = load_templates()
+    name, confidence = classify_template(query)
+    if confidence < min_confidence:
+        if not llm_fallback:
+            return templates[DEFAULT_TEMPLATE]
+        response = await llm_generate_async(_router_prompt(query, context_chunks, templates), tag="select")
+        return _resolve_template(templates, response, name)
+    return templates[name]
 
 
 # test the function
@@ -62,6 +119,7 @@ if __name__ == "__main__":
         {'page_content': "New product launch is scheduled for next month."}
     ]
     
+    print("Classifier:", classify_template(query))
     prompt_content = select_prompt(query, context_chunks)
     
     print("\n" + "="*30)
@@ -0,0 +1,226 @@
+"""
+Parameter sweep over chunking and retrieval settings.
+
+Runs every combination of chunk_size x chunk_overlap x top_k x retriever x
+query expansion while doing each piece of shared work only once:
+documents are loaded and split into sentences once, each query is expanded
+once (and the LLM response cache is shared by every grid point), each
+(chunking, retriever) pair is indexed and queried once at the largest top_k,
+and smaller top_k values reuse a prefix of that ranking. Independent
+(chunking, retriever) groups run in parallel.
+
+Scores are averaged per grid point and written as one comparison table in the
+same format as rageval2/evaluation/process_intermediate.py
+({grid point: {metric: average}}).
+
+Example:
+    python My_RAG/sweep.py --query_path ./dragonball_dataset/test_queries_en.jsonl \
+        --docs_path ./dragonball_dataset/dragonball_docs.jsonl --language en \
+        --chunk_sizes 300,500,1000 --chunk_overlaps 100,150 --top_ks 1,2,5 \
+        --retrievers pyserini,bm25 --expand both --output ./result/sweep_en.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from pathlib import Path
+import argparse
+import copy
+import json
+import sys
+import time
+
+from chunker import iter_chunk_spans, is_chunkable, make_chunk, split_sentence_spans
+from generator import generate_answer
+from pyserini_retriever import create_retriever as create_pyserini_retriever
+from retriever import create_retriever as create_bm25_retriever
+from selector import select_prompt
+from utils import expand_query, get_llm_client, load_jsonl, save_jsonl
+
+
+EVALUATION_DIR = Path(__file__).parent.parent / "rageval2" / "evaluation"
+RETRIEVAL_METRICS = ["precision", "recall", "eir"]
+METRIC_LIST = ['EIR', 'Precision', 'Recall', 'ROUGELScore']
+RETRIEVERS = ("pyserini", "bm25")
+
+
+def _load_evaluation():
+    """Imports the rageval2 metrics and table helpers (they live outside My_RAG)."""
+    if str(EVALUATION_DIR) not in sys.path:
+        sys.path.insert(0, str(EVALUATION_DIR))
+    from metrics import get_metric
+    from process_intermediate import calculate_averages
+    return get_metric, calculate_averages
+
+
+def point_name(chunk_size, chunk_overlap, top_k, retriever, expand):
+    name = f"chunk={chunk_size}_overlap={chunk_overlap}_top{top_k}_{retriever}"
+    return name + ("_expand" if expand else "")
+
+
+class SweepContext:
+    """Work shared by every grid point: documents, sentence splits, queries and expansions."""
+
+    def __init__(self, queries, docs, language, index_threads=None, search_threads=None):
+        self.queries = queries
+        self.language = language
+        self.index_threads = index_threads
+        self.search_threads = search_threads
+        self.docs = [doc for doc in docs if is_chunkable(doc, language)]
+        start = time.perf_counter()
+        self.sentence_spans = [split_sentence_spans(doc['content'], language) for doc in self.docs]
+        print(f"Split {len(self.docs)} documents into sentences in {time.perf_counter() - start:.2f}s")
+        self.expansions = None
+
+    def expand_queries(self, workers):
+        """Expands every query once; the results are reused by all expanded grid points."""
+        texts = [query['query']['content'] for query in self.queries]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            self.expansions = list(executor.map(lambda text: expand_query(text, self.language), texts))
+
+    def search_queries(self, expand):
+        texts = [query['query']['content'] for query in self.queries]
+        if not expand:
+            return texts
+        return [f"{text} {expansion}" for text, expansion in zip(texts, self.expansions)]
+
+    def chunk(self, chunk_size, chunk_overlap):
+        """Chunks from the shared sentence splits (same chunks as chunk_documents)."""
+        chunks = []
+        for doc, spans in zip(self.docs, self.sentence_spans):
+            text = doc['content']
+            for start, end in iter_chunk_spans(text, self.language, chunk_size, chunk_overlap, sentence_spans=spans):
+                chunks.append(make_chunk(doc, text, start, end, len(chunks)))
+        return chunks
+
+    def create_retriever(self, name, chunks, chunk_params):
+        if name == "bm25":
+            return create_bm25_retriever(chunks, self.language)
+        return create_pyserini_retriever(chunks, self.language, chunk_params=chunk_params,
+                                         index_threads=self.index_threads)
+
+
+def score_predictions(items, language, generate):
+    """Scores prediction items in place with the rageval2 metrics and returns their averages."""
+    get_metric, calculate_averages = _load_evaluation()
+    evaluators = [get_metric(name)() for name in RETRIEVAL_METRICS]
+    if generate:
+        evaluators.append(get_metric("rouge-l")())
+    for item in items:
+        for evaluator in evaluators:
+            item[evaluator.name] = evaluator(item, item["ground_truth"], None, language=language)
+    return calculate_averages(items, METRIC_LIST)
+
+
+def run_group(context, chunk_size, chunk_overlap, retriever_name, top_ks, expand_options, generate):
+    """
+    Runs every grid point that shares one chunking and retriever.
+
+    Returns:
+        {grid point name: (scored items, averages)}
+    """
+    chunk_params = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    chunks = context.chunk(chunk_size, chunk_overlap)
+    retriever = context.create_retriever(retriever_name, chunks, chunk_params)
+    max_top_k = max(top_ks)
+
+    results = {}
+    for expand in expand_options:
+        rankings = retriever.retrieve_batch(context.search_queries(expand), top_k=max_top_k,
+                                            threads=context.search_threads)
+        for top_k in top_ks:
+            items = []
+            for query, ranking in zip(context.queries, rankings):
+                item = copy.deepcopy(query)
+                retrieved = ranking[:top_k]
+                item.setdefault("prediction", {})
+                item["prediction"]["references"] = [chunk['page_content'] for chunk in retrieved]
+                if generate:
+                    query_text = query['query']['content']
+                    prompt_template = select_prompt(query_text, retrieved)
+                    item["prediction"]["content"] = generate_answer(query_text, retrieved, prompt_template,
+                                                                    context.language)
+                items.append(item)
+            name = point_name(chunk_size, chunk_overlap, top_k, retriever_name, expand)
+            results[name] = (items, score_predictions(items, context.language, generate))
+            print(f"[sweep] {name}: {results[name][1]}")
+    return results
+
+
+def run_sweep(query_path, docs_path, language, output_path, chunk_sizes, chunk_overlaps, top_ks,
+              retrievers=("pyserini",), expand_options=(True,), generate=False, workers=2,
+              index_threads=None, search_threads=None, predictions_dir=None):
+    """
+    Runs the grid and writes the comparison table.
+
+    Args:
+        chunk_sizes, chunk_overlaps, top_ks: Values to combine (overlaps >= chunk size are skipped)
+        retrievers: Any of 'pyserini', 'bm25'
+        expand_options: Which of (True, False) query expansion settings to run
+        generate: Also generate answers (scored with ROUGE-L); otherwise retrieval metrics only
+        workers: Grid groups run in parallel, also used for query expansion
+        predictions_dir: If set, scored predictions of each grid point are saved there
+    """
+    start = time.perf_counter()
+    queries = [q for q in load_jsonl(query_path) if q.get("language", language) == language]
+    if any("ground_truth" not in q for q in queries):
+        raise ValueError(f"{query_path} has queries without ground_truth; the sweep needs labelled queries.")
+    context = SweepContext(queries, load_jsonl(docs_path), language, index_threads, search_threads)
+    if any(expand_options):
+        print("Expanding queries...")
+        context.expand_queries(workers)
+
+    groups = [(size, overlap, retriever) for size, overlap, retriever in product(chunk_sizes, chunk_overlaps, retrievers)
+              if overlap < size]
+    print(f"Running {len(groups) * len(top_ks) * len(expand_options)} grid points in {len(groups)} groups...")
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_group, context, size, overlap, retriever, top_ks, expand_options, generate)
+                   for size, overlap, retriever in groups]
+        for future in futures:
+            results.update(future.result())
+
+    table = {name: averages for name, (_, averages) in results.items()}
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(table, f, indent=2, ensure_ascii=False)
+    if predictions_dir:
+        Path(predictions_dir).mkdir(parents=True, exist_ok=True)
+        for name, (items, _) in results.items():
+            save_jsonl(Path(predictions_dir) / f"{name}.jsonl", items)
+
+    print(f"Sweep finished in {time.perf_counter() - start:.1f}s. Results saved to {output_path}")
+    print(get_llm_client().timing_summary())
+    return table
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query_path', help='Path to the query file (with ground truth)')
+    parser.add_argument('--docs_path', help='Path to the documents file')
+    parser.add_argument('--language', help='Language of queries and documents (zh or en)')
+    parser.add_argument('--output', help='Path to the comparison table (process_intermediate format)')
+    parser.add_argument('--chunk_sizes', type=_int_list, default=[300, 500, 1000])
+    parser.add_argument('--chunk_overlaps', type=_int_list, default=[100])
+    parser.add_argument('--top_ks', type=_int_list, default=[2, 5])
+    parser.add_argument('--retrievers', default='pyserini', help=f"Comma-separated, any of {', '.join(RETRIEVERS)}")
+    parser.add_argument('--expand', choices=['on', 'off', 'both'], default='on', help='Query expansion settings to run')
+    parser.add_argument('--generate', action='store_true', help='Also generate answers and score ROUGE-L')
+    parser.add_argument('--workers', type=int, default=2, help='Grid groups run in parallel')
+    parser.add_argument('--index_threads', type=int, default=None, help='Lucene indexing threads (default: CPU count)')
+    parser.add_argument('--search_threads', type=int, default=None, help='Batch retrieval threads (default: CPU count)')
+    parser.add_argument('--predictions_dir', default=None, help='Optionally save scored predictions per grid point')
+    args = parser.parse_args()
+
+    retrievers = [r for r in args.retrievers.split(',') if r]
+    unknown = set(retrievers) - set(RETRIEVERS)
+    if unknown:
+        parser.error(f"Unknown retrievers: {', '.join(sorted(unknown))}")
+    expand_options = {'on': [True], 'off': [False], 'both': [False, True]}[args.expand]
+    run_sweep(args.query_path, args.docs_path, args.language, args.output,
+              args.chunk_sizes, args.chunk_overlaps, args.top_ks,
+              retrievers=retrievers, expand_options=expand_options, generate=args.generate,
+              workers=args.workers, index_threads=args.index_threads, search_threads=args.search_threads,
+              predictions_dir=args.predictions_dir)
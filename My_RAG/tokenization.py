@@ -0,0 +1,168 @@
+"""
+Shared word tokenization for BM25 (jieba for Chinese, spaces for English).
+
+Chinese segmentation is the expensive part, so it is cached at three levels:
+    - a persistent SQLite token cache keyed by the text hash, so corpus
+      chunks are segmented once across runs;
+    - an in-process LRU for short query-time strings;
+    - jieba's prefix dictionary is cached next to the token cache (instead
+      of the system temp dir) by warm_up(), which also loads it eagerly.
+Corpus segmentation can optionally run on a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import hashlib
+import sqlite3
+import threading
+import jieba
+
+
+TOKEN_CACHE_DIR = Path(__file__).parent.parent / "llm_cache"
+DEFAULT_TOKEN_CACHE_PATH = TOKEN_CACHE_DIR / "tokens.sqlite"
+# Bump when the segmentation changes (e.g. a custom jieba dictionary), invalidating cached tokens
+TOKENIZER_VERSION = 1
+# Tokens are stored joined by a character that never occurs in the text
+_SEPARATOR = "\x00"
+# SQLite limits the number of host parameters per statement
+_LOOKUP_BATCH = 500
+
+
+def _use_cache_dir():
+    """Keeps jieba's prefix dictionary cache with the other caches so it survives temp dir cleanup."""
+    TOKEN_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    jieba.dt.tmp_dir = str(TOKEN_CACHE_DIR)
+
+
+def warm_up(background=False):
+    """Loads jieba's dictionary now rather than on the first Chinese cut."""
+    _use_cache_dir()
+    if background:
+        thread = threading.Thread(target=jieba.initialize, name="jieba-warm-up", daemon=True)
+        thread.start()
+        return thread
+    jieba.initialize()
+
+
+def _segment(text, language):
+    if language == "zh":
+        return list(jieba.cut(text))
+    return text.split(" ")
+
+
+def _segment_many(args):
+    """Worker: segments a shard of texts."""
+    texts, language = args
+    # Spawned workers import this module afresh, so point them at the warm dictionary cache
+    _use_cache_dir()
+    return [_segment(text, language) for text in texts]
+
+
+def _token_key(text, language):
+    return hashlib.sha256(f"{TOKENIZER_VERSION}:{language}:{text}".encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+
+    def __init__(self, path=DEFAULT_TOKEN_CACHE_PATH):
+        """
+        Args:
+            path: SQLite file holding the cached token lists
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, tokens TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """Returns {key: token list} for the keys that are cached."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[i:i + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, tokens FROM tokens WHERE key IN ({placeholders})",
+                                          batch).fetchall()
+                for key, tokens in rows:
+                    found[key] = tokens.split(_SEPARATOR) if tokens else []
+        return found
+
+    def put_many(self, items):
+        """Stores (key, token list) pairs."""
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO tokens (key, tokens) VALUES (?, ?)",
+                                   [(key, _SEPARATOR.join(tokens)) for key, tokens in items])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache() -> TokenCache:
+    """Returns the shared TokenCache, opening it on first use."""
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = TokenCache()
+    return _token_cache
+
+
+@lru_cache(maxsize=65536)
+def _tokenize_cached(text, language):
+    return tuple(_segment(text, language))
+
+
+def tokenize_query(text, language):
+    """Tokenizes a query-time string through an in-process LRU."""
+    return list(_tokenize_cached(text, language))
+
+
+def tokenize_corpus(texts, language, workers=1, use_cache=True):
+    """
+    Tokenizes corpus texts. Chinese texts go through the persistent token cache;
+    misses are segmented (on a process pool when workers > 1) and stored.
+    English splitting is cheaper than a cache lookup and is never cached.
+
+    Returns:
+        List of token lists, in the order of texts
+    """
+    if language != "zh" or not use_cache:
+        return _parallel_segment(list(texts), language, workers)
+
+    texts = list(texts)
+    keys = [_token_key(text, language) for text in texts]
+    cache = get_token_cache()
+    found = cache.get_many(list(dict.fromkeys(keys)))
+    num_cached = sum(key in found for key in keys)
+    missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+    if missing:
+        segmented = _parallel_segment(missing, language, workers)
+        new_items = [(_token_key(text, language), tokens) for text, tokens in zip(missing, segmented)]
+        cache.put_many(new_items)
+        found.update(new_items)
+    print(f"Tokenized {len(texts)} texts ({num_cached} from the token cache)")
+    return [found[key] for key in keys]
+
+
+def _parallel_segment(texts, language, workers):
+    if not workers or workers <= 1 or len(texts) < 2:
+        return [_segment(text, language) for text in texts]
+    warm_up()
+    # A few shards per worker; workers load jieba from the warm dictionary cache
+    num_shards = min(len(texts), workers * 4)
+    shard_size = -(-len(texts) // num_shards)
+    shards = [(texts[i:i + shard_size], language) for i in range(0, len(texts), shard_size)]
+    tokens = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard_tokens in executor.map(_segment_many, shards):
+            tokens.extend(shard_tokens)
+    return tokens
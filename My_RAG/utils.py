@@ -1,6 +1,15 @@
-from ollama import Client
+from ollama import AsyncClient, Client
 from pathlib import Path
+from llm_cache import LLMResponseCache, make_cache_key
+from embedding_cache import EmbeddingCache, make_embedding_key
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import httpx
 import jsonlines
+import numpy as np
 import yaml
 
 
@@ -12,6 +21,29 @@ def load_jsonl(file_path):
     return docs
 
 
+def iter_jsonl(file_path, language=None):
+    """
+    Lazily yields objects from a JSONL file, one line at a time.
+
+    Args:
+        file_path: Path to the JSONL file.
+        language: If given, only objects whose 'language' field matches are yielded.
+    """
+    with jsonlines.open(file_path, 'r') as reader:
+        for obj in reader:
+            if language is None or obj.get('language') == language:
+                yield obj
+
+
+def file_sha256(file_path, block_size=1 << 20) -> str:
+    """Streams a file through SHA-256 (used as an index cache key for streamed corpora)."""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
 def save_jsonl(file_path, data):
     with jsonlines.open(file_path, mode='w') as writer:
         for item in data:
@@ -42,43 +74,367 @@ def load_ollama_config() -> dict:
     return config["ollama"]
     
 
-def llm_generate(prompt: str, model: str = "granite4:3b") -> str:
+DEFAULT_EMBED_MODEL = "qwen3-embedding:0.6b"
+# Texts per /api/embed request
+DEFAULT_EMBED_BATCH_SIZE = 256
+
+
+def _generate_options() -> dict:
+    """ 
+        num_ctx, temperature, num_predict
+        explaination in Final_Tutorials 4
+    """
+    return {
+        "temperature": 0.0
+    }
+
+
+class LLMClient:
+    """
+    Process-wide Ollama client.
+
+    Loads the config once, keeps HTTP connections alive in a pool (shared by
+    every stage: expansion, reranking, routing and generation) and records the
+    wall-clock time of each call per stage tag. Deterministic calls
+    (temperature 0) are answered from a persistent response cache when possible.
+    """
+
+    def __init__(self, config: dict = None, pool_size: int = 16, use_cache: bool = None, cache=None):
+        self.config = config or load_ollama_config()
+        self.host = self.config["host"]
+        self.model = self.config["model"]
+        self.embed_model = self.config.get("embed_model", DEFAULT_EMBED_MODEL)
+        self.pool_size = pool_size
+        # ollama.Client forwards extra kwargs to httpx.Client
+        self._client = Client(host=self.host, limits=self._limits())
+        self._async_client = None
+        self._async_loop = None
+        self._stats_lock = threading.Lock()
+        self.stats = {}
+        self.stream_stats = []
+        self.last_call_seconds = 0.0
+        # Bypass with use_cache=False or LLM_CACHE=0 in the environment
+        if use_cache is None:
+            use_cache = os.environ.get("LLM_CACHE", "1") != "0"
+        self.use_cache = use_cache
+        self._cache = cache
+        self._embedding_cache = None
+
+    @property
+    def cache(self) -> LLMResponseCache:
+        # Opened lazily so a bypassed cache never touches the disk
+        if self._cache is None:
+            self._cache = LLMResponseCache()
+        return self._cache
+
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        if self._embedding_cache is None:
+            self._embedding_cache = EmbeddingCache()
+        return self._embedding_cache
+
+    def _cache_key(self, prompt: str, options: dict, use_cache: bool, format=None):
+        """Returns the cache key, or None when the call must not be cached."""
+        if not (self.use_cache and use_cache):
+            return None
+        if options.get("temperature", 1.0) != 0.0:
+            return None
+        if format is not None:
+            return make_cache_key(self.model, prompt, options, format=format)
+        return make_cache_key(self.model, prompt, options)
+
+    def _limits(self):
+        return httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+
+    def _get_async_client(self) -> AsyncClient:
+        # httpx.AsyncClient is bound to the event loop it was first used on
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = AsyncClient(host=self.host, limits=self._limits())
+            self._async_loop = loop
+        return self._async_client
+
+    def _record(self, tag: str, seconds: float):
+        with self._stats_lock:
+            entry = self.stats.setdefault(tag, {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+            entry["calls"] += 1
+            entry["total_s"] += seconds
+            entry["max_s"] = max(entry["max_s"], seconds)
+            self.last_call_seconds = seconds
+
+    def generate(self, prompt: str, tag: str = "generate", options: dict = None, use_cache: bool = True,
+                 format=None) -> str:
+        """
+        Args:
+            format: Optional 'json' or JSON schema dict constraining the output.
+        """
+        options = options or _generate_options()
+        key = self._cache_key(prompt, options, use_cache, format)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        start = time.perf_counter()
+        try:
+            response = self._client.generate(
+                model=self.model,
+                prompt=prompt,
+                stream=False,
+                format=format,
+                options=options
+            )
+        finally:
+            self._record(tag, time.perf_counter() - start)
+        text = response.get("response", "No response from model.")
+        if key is not None:
+            self.cache.put(key, text)
+        return text
+
+    async def generate_async(self, prompt: str, tag: str = "generate", options: dict = None, use_cache: bool = True,
+                             format=None) -> str:
+        options = options or _generate_options()
+        key = self._cache_key(prompt, options, use_cache, format)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        start = time.perf_counter()
+        try:
+            response = await self._get_async_client().generate(
+                model=self.model,
+                prompt=prompt,
+                stream=False,
+                format=format,
+                options=options
+            )
+        finally:
+            self._record(tag, time.perf_counter() - start)
+        text = response.get("response", "No response from model.")
+        if key is not None:
+            self.cache.put(key, text)
+        return text
+
+    def embed(self, texts: list, tag: str = "embed", batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+              use_cache: bool = True, model: str = None) -> np.ndarray:
+        """
+        Embeds texts with the configured embedding model (or model, if given).
+
+        Duplicate texts are embedded once, cached vectors are reused and the
+        rest is sent in batches of batch_size texts per request.
+
+        Returns:
+            float32 array of shape (len(texts), dim), in input order
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        model = model or self.embed_model
+        unique = list(dict.fromkeys(texts))
+        keys = [make_embedding_key(model, text) for text in unique]
+        use_cache = self.use_cache and use_cache
+        vectors = self.embedding_cache.get_many(keys) if use_cache else {}
+
+        missing = [i for i, key in enumerate(keys) if key not in vectors]
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            start = time.perf_counter()
+            try:
+                response = self._client.embed(model=model, input=[unique[j] for j in batch])
+            finally:
+                self._record(tag, time.perf_counter() - start)
+            new_vectors = [(keys[j], np.asarray(vector, dtype=np.float32))
+                           for j, vector in zip(batch, response["embeddings"])]
+            vectors.update(new_vectors)
+            if use_cache:
+                self.embedding_cache.put_many(new_vectors)
+
+        row_of = {text: i for i, text in enumerate(unique)}
+        matrix = np.stack([vectors[key] for key in keys])
+        return matrix[[row_of[text] for text in texts]]
+
+    def _stream_options(self, options: dict, num_predict: int, stop: list) -> dict:
+        options = dict(options or _generate_options())
+        if num_predict is not None:
+            # Hard cap on generated tokens; the server stops early once reached
+            options["num_predict"] = num_predict
+        if stop:
+            options["stop"] = list(stop)
+        return options
+
+    def _finish_stream(self, tag: str, start: float, first_token_at, final: dict) -> dict:
+        total = time.perf_counter() - start
+        eval_count = final.get("eval_count") or 0
+        eval_seconds = (final.get("eval_duration") or 0) / 1e9
+        stats = {
+            "ttft_s": (first_token_at - start) if first_token_at is not None else total,
+            "total_s": total,
+            "eval_count": eval_count,
+            "tokens_per_s": eval_count / eval_seconds if eval_seconds > 0 else 0.0,
+            "done_reason": final.get("done_reason"),
+        }
+        self._record(tag, total)
+        with self._stats_lock:
+            self.stream_stats.append(stats)
+        return stats
+
+    def generate_stream(self, prompt: str, tag: str = "generate", options: dict = None, num_predict: int = None,
+                        stop: list = None, use_cache: bool = True):
+        """
+        Streams a generation, stopping at num_predict tokens or a stop sequence.
+
+        Returns:
+            (text, stats) where stats holds ttft_s, total_s, eval_count, tokens_per_s
+            and done_reason. stats is None when the answer came from the cache.
+        """
+        options = self._stream_options(options, num_predict, stop)
+        key = self._cache_key(prompt, options, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, None
+
+        start = time.perf_counter()
+        first_token_at = None
+        parts = []
+        final = {}
+        for part in self._client.generate(model=self.model, prompt=prompt, stream=True, options=options):
+            piece = part.get("response", "")
+            if piece and first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(piece)
+            if part.get("done"):
+                final = part
+        stats = self._finish_stream(tag, start, first_token_at, final)
+        text = "".join(parts)
+        if key is not None:
+            self.cache.put(key, text)
+        return text, stats
+
+    async def generate_stream_async(self, prompt: str, tag: str = "generate", options: dict = None,
+                                    num_predict: int = None, stop: list = None, use_cache: bool = True):
+        """Async variant of generate_stream."""
+        options = self._stream_options(options, num_predict, stop)
+        key = self._cache_key(prompt, options, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, None
+
+        start = time.perf_counter()
+        first_token_at = None
+        parts = []
+        final = {}
+        async for part in await self._get_async_client().generate(model=self.model, prompt=prompt, stream=True,
+                                                                    options=options):
+            piece = part.get("response", "")
+            if piece and first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(piece)
+            if part.get("done"):
+                final = part
+        stats = self._finish_stream(tag, start, first_token_at, final)
+        text = "".join(parts)
+        if key is not None:
+            self.cache.put(key, text)
+        return text, stats
+
+    def timing_summary(self) -> str:
+        lines = []
+        with self._stats_lock:
+            for tag, entry in sorted(self.stats.items()):
+                mean = entry["total_s"] / entry["calls"]
+                lines.append(f"  {tag:<10} calls={entry['calls']:<5} total={entry['total_s']:.1f}s "
+                             f"mean={mean:.2f}s max={entry['max_s']:.2f}s")
+            if self.stream_stats:
+                ttfts = sorted(st["ttft_s"] for st in self.stream_stats)
+                rates = [st["tokens_per_s"] for st in self.stream_stats if st["tokens_per_s"] > 0]
+                p95 = ttfts[min(len(ttfts) - 1, int(0.95 * len(ttfts)))]
+                lines.append(f"  streamed   calls={len(ttfts):<5} ttft_mean={sum(ttfts) / len(ttfts):.2f}s "
+                             f"ttft_p95={p95:.2f}s tok/s={sum(rates) / max(len(rates), 1):.1f}")
+        summary = "LLM timings:\n" + "\n".join(lines) if lines else "LLM timings: no calls"
+        if self.use_cache and self._cache is not None:
+            summary += "\n" + self._cache.stats()
+        if self.use_cache and self._embedding_cache is not None:
+            summary += "\n" + self._embedding_cache.stats()
+        return summary
+
+    def close_caches(self):
+        """Closes the response and embedding caches (writing pending hits); they reopen on next use."""
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+        if self._embedding_cache is not None:
+            self._embedding_cache.close()
+            self._embedding_cache = None
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Returns the shared LLMClient, creating it on first use."""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = LLMClient()
+    return _llm_client
+
+
+def llm_generate(prompt: str, model: str = "granite4:3b", tag: str = "generate", options: dict = None) -> str:
     """
     Sends a prompt to the Ollama model and returns the response.
 
     Args:
         prompt: The prompt to send to the model.
         model: The name of the model to use.
+        tag: Stage name used to group call timings (e.g. 'expand', 'select').
+        options: Ollama options; defaults to temperature 0.
 
     Returns:
         The model's response as a string.
     """
     try:
-        ollama_config = load_ollama_config()
-        client = Client(host=ollama_config["host"])
-        """ 
-            num_ctx, temperature, num_predict
-            explaination in Final_Tutorials 4
-        """
-        response = client.generate(
-            model=ollama_config["model"], 
-            prompt=prompt, 
-            stream=False, 
-            options={
-                "temperature": 0.0
-            }
-        )
-        return response.get("response", "No response from model.")
+        return get_llm_client().generate(prompt, tag=tag, options=options)
+    except Exception as e:
+        return f"Error using Ollama Python client: {e}"
+
+
+async def llm_generate_async(prompt: str, model: str = "granite4:3b", tag: str = "generate",
+                             options: dict = None) -> str:
+    """
+    Async variant of llm_generate built on ollama.AsyncClient, so several
+    requests can be in flight on the Ollama server at once.
+
+    Args:
+        prompt: The prompt to send to the model.
+        model: The name of the model to use.
+        tag: Stage name used to group call timings.
+        options: Ollama options; defaults to temperature 0.
+
+    Returns:
+        The model's response as a string.
+    """
+    try:
+        return await get_llm_client().generate_async(prompt, tag=tag, options=options)
     except Exception as e:
         return f"Error using Ollama Python client: {e}"
     
 
-def expand_query(query_text, language):
+def _expand_query_prompt(query_text, language):
     if language == 'zh':
-        prompt = f"You are a search query optimizer. Please generate an expanded query containing synonyms, relevant entities, and keywords based on the user's original query to improve retrieval recall. Output ONLY the expanded keyword string in Simplified Chinese without any explanation or prefix.\n\nOriginal Query: {query_text}\nExpanded Query:"
-    else:
-        prompt = f"You are a search query optimizer. Please generate an expanded query containing synonyms, relevant entities, and keywords based on the user's original query to improve retrieval recall. Output ONLY the expanded keyword string without any explanation or prefix.\n\nOriginal Query: {query_text}\nExpanded Query:"
-    return llm_generate(prompt)
+        return f"You are a search query optimizer. Please generate an expanded query containing synonyms, relevant entities, and keywords based on the user's original query to improve retrieval recall. Output ONLY the expanded keyword string in Simplified Chinese without any explanation or prefix.\n\nOriginal Query: {query_text}\nExpanded Query:"
+    return f"You are a search query optimizer. Please generate an expanded query containing synonyms, relevant entities, and keywords based on the user's original query to improve retrieval recall. Output ONLY the expanded keyword string without any explanation or prefix.\n\nOriginal Query: {query_text}\nExpanded Query:"
+
+
+def expand_query(query_text, language):
+    return llm_generate(_expand_query_prompt(query_text, language), tag="expand")
+
+
+async def expand_query_async(query_text, language):
+    return await llm_generate_async(_expand_query_prompt(query_text, language), tag="expand")
 
 
 def rerank_chunks(query, chunks, language, top_k=5):
@@ -120,7 +476,7 @@ Candidate Document Chunks:
 Output (JSON Array ONLY):
 """
 
-    response = llm_generate(prompt)
+    response = llm_generate(prompt, tag="rerank")
     
     # Parse the response to get indices
     try:
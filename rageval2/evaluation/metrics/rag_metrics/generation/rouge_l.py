@@ -1,8 +1,17 @@
+from functools import lru_cache
 from rouge import Rouge
 import numpy as np
 import rouge_chinese
 import jieba # you can use any other word cutting library
 
+
+@lru_cache(maxsize=16384)
+def _cut(text):
+    # References repeat across runs/grid points scored in one process; segment each text once.
+    # The evaluator runs standalone (it never imports My_RAG), so it keeps this small cut
+    # instead of the pipeline's tokenization layer and its on-disk token cache.
+    return ' '.join(jieba.cut(text))
+
 class ROUGELScore:
     name:str = "ROUGELScore"
     def __init__(self, language="zh"):
@@ -13,8 +22,8 @@ class ROUGELScore:
         hypothesis = doc["prediction"]["content"]
         reference = doc["ground_truth"]["content"]
         if language == "zh":
-            hypothesis = ' '.join(jieba.cut(hypothesis))
-            reference = ' '.join(jieba.cut(reference))
+            hypothesis = _cut(hypothesis)
+            reference = _cut(reference)
             if hypothesis=='' or reference=='':
                 return 0.0
             score = self._calculate_rouge_l_score_chinese(hypothesis, reference)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The pipeline modules use flat imports (from utils import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "My_RAG"))
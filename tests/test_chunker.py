@@ -0,0 +1,24 @@
+from chunker import chunk_documents
+
+
+DOCS = [
+    {"doc_id": 1, "language": "en", "domain": "Finance",
+     "content": "Alpha rose. Beta fell!  Gamma held?\nDelta closed. Epsilon opened."},
+    {"doc_id": 2, "language": "zh", "domain": "Finance", "content": "甲公司上市。乙公司亏损！丙公司并购？丁公司重组。"},
+]
+
+
+def test_english_chunks_join_sentences_like_the_sentence_chunker():
+    chunks = chunk_documents(DOCS, "en", chunk_size=25, chunk_overlap=12)
+    assert [chunk['page_content'] for chunk in chunks] == [
+        "Alpha rose.Beta fell!", "Beta fell!Gamma held?", "Gamma held?Delta closed.", "Epsilon opened."]
+    text = DOCS[0]["content"]
+    metadata = chunks[1]['metadata']
+    assert text[metadata['start_index']:metadata['end_index']] == "Beta fell!  Gamma held?"
+
+
+def test_compact_store_matches_chunk_dicts():
+    for language in ("en", "zh"):
+        chunks = chunk_documents(DOCS, language, chunk_size=12, chunk_overlap=6)
+        store = chunk_documents(DOCS, language, chunk_size=12, chunk_overlap=6, compact=True)
+        assert [chunk.to_dict() for chunk in store] == chunks
@@ -0,0 +1,31 @@
+from chunker import chunk_documents
+from context_packer import CONTEXT_SEPARATOR, chunk_sentences, pack_context
+
+from test_chunker import DOCS
+
+
+class CharCounter:
+    """One token per character, so budgets are easy to reason about."""
+
+    def count(self, text):
+        return len(text)
+
+
+def test_english_chunk_texts_split_into_their_sentences():
+    chunks = chunk_documents(DOCS, "en", chunk_size=25, chunk_overlap=12)
+    assert chunk_sentences(chunks[0]['page_content'], "en") == ["Alpha rose.", "Beta fell!"]
+    assert chunk_sentences("Revenue rose 3.5% in 2019. Costs fell.", "en") == ["Revenue rose 3.5% in 2019. ", "Costs fell."]
+
+
+def test_oversized_chunk_is_cut_at_a_sentence_and_later_chunks_still_fit():
+    chunks = [{'page_content': "Alpha rose.Beta fell!"}, {'page_content': "Gamma held?Delta closed.Omega."},
+              {'page_content': "Short."}]
+    separator = len(CONTEXT_SEPARATOR)
+    budget = len("Alpha rose.Beta fell!") + separator + len("Gamma held?") + separator + len("Short.")
+    packed = pack_context(chunks, budget, "en", CharCounter())
+    assert packed.split(CONTEXT_SEPARATOR) == ["Alpha rose.Beta fell!", "Gamma held?", "Short."]
+
+
+def test_chinese_chunk_is_cut_at_a_sentence():
+    chunks = [{'page_content': "甲公司上市。乙公司亏损！"}]
+    assert pack_context(chunks, len("甲公司上市。"), "zh", CharCounter()) == "甲公司上市。"
@@ -0,0 +1,49 @@
+from entity_index import create_entity_filtered_retriever
+from query_cache import create_cached_retriever
+from retriever import create_retriever
+
+
+def make_chunks():
+    rows = [("Green Fields Agriculture appointed a new CEO.", "Green Fields Agriculture Ltd."),
+            ("Green Fields Agriculture expanded its farmland.", "Green Fields Agriculture Ltd."),
+            ("Retail Emporium appointed a new CEO.", "Retail Emporium"),
+            ("Retail Emporium opened three stores.", "Retail Emporium")]
+    return [{'page_content': text, 'metadata': {'chunk_index': i, 'doc_id': i // 2, 'company_name': name}}
+            for i, (text, name) in enumerate(rows)]
+
+
+class RecordingRetriever:
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = []
+
+    def cache_settings(self):
+        return self.inner.cache_settings()
+
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        self.calls.append((list(queries), top_k, allowed_ids))
+        return self.inner.retrieve_batch(queries, top_k=top_k, with_scores=with_scores, allowed_ids=allowed_ids)
+
+
+def test_entities_are_matched_on_the_raw_query_through_the_cache():
+    chunks = make_chunks()
+    inner = RecordingRetriever(create_retriever(chunks, "en"))
+    retriever = create_cached_retriever(create_entity_filtered_retriever(inner, chunks))
+    raw = "Who was appointed CEO?"
+    # The expansion names a company the user never mentioned
+    expanded = f"{raw} Retail Emporium chief executive"
+    results = retriever.retrieve_batch([expanded], top_k=4, allowed_ids=retriever.allowlists([raw]))
+    assert inner.calls[-1][2] is None
+    assert len(results[0]) == 4
+
+
+def test_filtered_queries_are_searched_at_the_reduced_k():
+    chunks = make_chunks()
+    inner = RecordingRetriever(create_retriever(chunks, "en"))
+    retriever = create_entity_filtered_retriever(inner, chunks, filtered_top_k=1)
+    queries = ["Who did Retail Emporium appoint as CEO?", "Who was appointed CEO?"]
+    results = retriever.retrieve_batch(queries, top_k=3)
+    assert sorted((call[0], call[1]) for call in inner.calls) == [([queries[0]], 1), ([queries[1]], 3)]
+    assert [len(result) for result in results] == [1, 3]
+    assert results[0][0]['metadata']['company_name'] == "Retail Emporium"
@@ -0,0 +1,25 @@
+from llm_cache import LLMResponseCache
+
+
+def test_eviction_keeps_recent_hits_and_count_survives_reopen(tmp_path):
+    path = tmp_path / "responses.sqlite"
+    cache = LLMResponseCache(path, max_entries=3)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+    cache.put("a", "A2")
+    assert len(cache) == 3
+    # The hit on "b" is only held in memory until the eviction writes it
+    assert cache.get("b") == "B"
+    cache.put("d", "D")
+    assert len(cache) == 3
+    assert cache.get("c") is None
+    assert [cache.get(key) for key in ("a", "b", "d")] == ["A2", "B", "D"]
+    cache.close()
+
+    reopened = LLMResponseCache(path, max_entries=3)
+    assert len(reopened) == 3
+    reopened.put("e", "E")
+    # "a" was read before "b" and "d" in the last session; the close wrote those hits
+    assert reopened.get("a") is None
+    assert len(reopened) == 3
+    reopened.close()
@@ -0,0 +1,35 @@
+from chunk_store import span_text
+from chunker import chunk_documents
+from passage_merger import merge_passages
+
+from test_chunker import DOCS
+
+
+# Chunks overlapping by two sentences, with a double space inside the overlap
+MULTI_SENTENCE_OVERLAP = {"doc_id": 3, "language": "en", "domain": "Law", "content": "Aa b. Cc d.  Ee f. Gg h. Ii j."}
+
+
+def test_merged_passages_are_the_text_of_their_spans():
+    cases = [(DOCS[0], 25, 12), (MULTI_SENTENCE_OVERLAP, 18, 12), (DOCS[1], 12, 6)]
+    for doc, chunk_size, chunk_overlap in cases:
+        chunks = chunk_documents([doc], doc["language"], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        merged = merge_passages(chunks)
+        assert len(merged) < len(chunks)
+        for passage in merged:
+            metadata = passage['metadata']
+            assert passage['page_content'] == span_text(doc["content"], metadata['start_index'],
+                                                        metadata['end_index'], doc["language"])
+
+
+def test_consecutive_english_chunks_apart_by_sentence_whitespace_are_merged():
+    doc = DOCS[0]
+    chunks = chunk_documents([doc], "en", chunk_size=25, chunk_overlap=12)
+    last, previous = chunks[-1]['metadata'], chunks[-2]['metadata']
+    # "Delta closed." and "Epsilon opened." share no sentence; only a space lies between them
+    assert doc["content"][previous['end_index']:last['start_index']] == " "
+    merged = merge_passages([chunks[-1], chunks[-2]])
+    assert len(merged) == 1
+    assert merged[0]['page_content'] == "Gamma held?Delta closed.Epsilon opened."
+    assert merged[0]['metadata']['merged_chunks'] == [2, 3]
+    # Chunks that are not neighbours stay apart
+    assert len(merge_passages([chunks[0], chunks[3]])) == 2
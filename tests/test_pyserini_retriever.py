@@ -0,0 +1,89 @@
+"""Searcher wiring of PyseriniRetriever for each RM3 mode (needs pyserini; Lucene is faked)."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyserini.search.lucene")
+import pyserini_retriever  # noqa: E402
+
+
+class FakeSearcher:
+    """Mimics LuceneSearcher's RM3 restriction: Lucene Query objects cannot be searched with RM3 on."""
+
+    def __init__(self, index_dir):
+        self.rm3 = False
+        self.closed = False
+
+    def set_bm25(self, k1, b):
+        pass
+
+    def set_rm3(self, **kwargs):
+        self.rm3 = True
+
+    def set_language(self, language):
+        pass
+
+    def search(self, q, k=10):
+        if not isinstance(q, str) and self.rm3:
+            raise NotImplementedError('RM3 incompatible with search using a Lucene query.')
+        # Filtered queries only match the allowed ids; plain ones get a flat ranking (weak in adaptive mode)
+        ids = q.allowed_ids if not isinstance(q, str) else range(20)
+        return [SimpleNamespace(docid=str(i), score=10.0 - 0.01 * rank) for rank, i in enumerate(ids)][:k]
+
+    def batch_search(self, queries, qids, k=10, threads=1):
+        return {qid: self.search(query, k) for query, qid in zip(queries, qids)}
+
+    def close(self):
+        self.closed = True
+
+
+def make_retriever(monkeypatch, rm3):
+    monkeypatch.setattr(pyserini_retriever, "LuceneSearcher", FakeSearcher)
+    retriever = object.__new__(pyserini_retriever.PyseriniRetriever)
+    retriever.index_dir = "unused"
+    retriever.keep_index = True
+    retriever.language = "en"
+    retriever.rm3 = rm3
+    retriever.rm3_min_margin = pyserini_retriever.DEFAULT_RM3_MIN_MARGIN
+    retriever.feedback_log = []
+    retriever.chunks = [{'page_content': f"chunk {i}", 'metadata': {'chunk_index': i}} for i in range(20)]
+    retriever._open_searcher()
+    monkeypatch.setattr(retriever, "_filtered_query",
+                        lambda query, allowed_ids: SimpleNamespace(allowed_ids=list(allowed_ids)))
+    return retriever
+
+
+@pytest.mark.parametrize("rm3", ["always", "adaptive", "off"])
+def test_filtered_search_runs_without_rm3(monkeypatch, rm3):
+    retriever = make_retriever(monkeypatch, rm3)
+    assert not retriever.filter_searcher.rm3
+
+    results = retriever.retrieve("query", top_k=5, allowed_ids=[3, 7, 11])
+    assert [chunk['metadata']['chunk_index'] for chunk in results] == [3, 7, 11]
+
+    batch = retriever.retrieve_batch(["query", "other query"], top_k=5, allowed_ids=[[4], None])
+    assert [chunk['metadata']['chunk_index'] for chunk in batch[0]] == [4]
+    assert len(batch[1]) == 5
+
+
+@pytest.mark.parametrize("rm3, expects_rm3", [("always", True), ("adaptive", False), ("off", False)])
+def test_unfiltered_search_uses_mode_searcher(monkeypatch, rm3, expects_rm3):
+    retriever = make_retriever(monkeypatch, rm3)
+    settings = retriever.cache_settings()
+    assert retriever.searcher.rm3 is expects_rm3
+    assert (retriever.rm3_searcher is not None) is (rm3 == "adaptive")
+    retriever.retrieve("query", top_k=5)
+    # A flat first pass is weak, so adaptive mode falls back to RM3 and logs it
+    assert [entry['rm3'] for entry in retriever.feedback_log] == ([True] if rm3 == "adaptive" else [])
+    # Per-query logging must not change what result caches key on
+    assert retriever.cache_settings() == settings
+
+
+@pytest.mark.parametrize("rm3", ["always", "adaptive", "off"])
+def test_close_searchers_closes_each_searcher_once(monkeypatch, rm3):
+    retriever = make_retriever(monkeypatch, rm3)
+    opened = {id(s): s for s in (retriever.searcher, retriever.rm3_searcher, retriever.filter_searcher)
+              if s is not None}
+    retriever._close_searchers()
+    assert all(searcher.closed for searcher in opened.values())
+    assert retriever.searcher is None and retriever.rm3_searcher is None
@@ -0,0 +1,49 @@
+from query_cache import config_hash, create_cached_retriever, normalize_query
+from retriever import create_retriever
+
+
+def make_chunks():
+    texts = ["Green Fields Agriculture appointed a new CEO in January.",
+             "Retail Emporium opened three stores.",
+             "The court ruled on the contract dispute."]
+    return [{'page_content': text, 'metadata': {'chunk_index': i, 'doc_id': i}} for i, text in enumerate(texts)]
+
+
+class LoggingRetriever:
+    """Accumulates per-query state the way adaptive RM3 does; must not affect the cache key."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.feedback_log = []
+
+    def cache_settings(self):
+        return self.inner.cache_settings()
+
+    def retrieve_batch(self, queries, top_k=5, threads=None, with_scores=False, allowed_ids=None):
+        self.feedback_log.extend({'query': query} for query in queries)
+        return self.inner.retrieve_batch(queries, top_k=top_k, with_scores=with_scores, allowed_ids=allowed_ids)
+
+
+def test_normalize_query_ignores_case_whitespace_and_punctuation():
+    assert normalize_query("  Who is the CEO?") == normalize_query("who is  the ceo")
+
+
+def test_cache_key_is_stable_while_retriever_state_grows():
+    retriever = LoggingRetriever(create_retriever(make_chunks(), "en"))
+    cached = create_cached_retriever(retriever)
+    before = config_hash(retriever)
+    first = cached.retrieve_with_scores("new CEO", top_k=2)
+    assert config_hash(retriever) == before
+    assert cached.retrieve_with_scores("New CEO?", top_k=2) == first
+    assert (cached.hits, cached.misses) == (1, 1)
+    assert len(retriever.feedback_log) == 1
+
+
+def test_index_update_invalidates_entries():
+    chunks = make_chunks()
+    retriever = create_retriever(chunks, "en")
+    cached = create_cached_retriever(retriever)
+    cached.retrieve("court ruling", top_k=1)
+    retriever.index_version += 1
+    cached.retrieve("court ruling", top_k=1)
+    assert cached.misses == 2
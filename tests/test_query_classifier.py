@@ -0,0 +1,42 @@
+"""Calibration of the local query-type classifier on paraphrased queries it was not trained on."""
+import json
+from pathlib import Path
+
+from query_classifier import get_classifier, load_training_data
+from selector import DEFAULT_TEMPLATE, MIN_CONFIDENCE, load_templates, select_prompt
+
+HELDOUT_PATH = Path(__file__).parent / "data" / "heldout_query_types.jsonl"
+
+
+def load_heldout():
+    with open(HELDOUT_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_heldout_queries_are_not_training_queries():
+    texts, _ = load_training_data()
+    assert not {row["query"] for row in load_heldout()} & set(texts)
+
+
+def test_confidence_is_not_above_heldout_accuracy():
+    classifier = get_classifier()
+    predictions = [(classifier.predict(row["query"]), row["template"]) for row in load_heldout()]
+    accuracy = sum(label == template for (label, _), template in predictions) / len(predictions)
+    mean_confidence = sum(confidence for (_, confidence), _ in predictions) / len(predictions)
+    # Under-confidence only sends more queries to the fallback; over-confidence skips it
+    assert mean_confidence <= accuracy + 0.15
+
+
+def test_heldout_misroutes_are_below_the_confidence_gate():
+    classifier = get_classifier()
+    for row in load_heldout():
+        label, confidence = classifier.predict(row["query"])
+        if label != row["template"]:
+            assert confidence < MIN_CONFIDENCE, (row["query"], label, confidence)
+
+
+def test_default_routing_falls_back_to_the_default_template():
+    templates = load_templates()
+    for row in load_heldout():
+        selected = select_prompt(row["query"], [])
+        assert selected in (templates[row["template"]], templates[DEFAULT_TEMPLATE]), row["query"]